@@ -0,0 +1,314 @@
+"""Micro-benchmarks for the storage, inference and analytics paths.
+
+    python bench.py                                  # 1k, 10k, 100k and 1M entries
+    python bench.py --sizes 1000 10000 --save-baseline
+    python bench.py --sizes 1000 10000 --tolerance 0.3
+
+Every size runs in a fresh process against a synthetic Thai diary built
+from thai_eval_corpus.txt (cached under bench_data/). Sentiment goes
+through a tiny randomly initialised BERT written to bench_data/tiny-model,
+so nothing is downloaded and the numbers measure our code, not the real
+model. Reports throughput, p50/p99 latency and the process's peak RSS.
+Results are compared with bench_baseline.json, recorded on the same
+machine with ``--save-baseline``; the run exits 1 if a p50, p99 or peak
+RSS grew past its tolerance, and 2 if there is no baseline to compare with.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import get_context
+
+from check_backends import read_corpus
+
+DATA_DIR = "bench_data"
+BASELINE_FILE = "bench_baseline.json"
+CORPUS_FILE = "thai_eval_corpus.txt"
+SIZES = [1000, 10_000, 100_000, 1_000_000]
+FIRST_DAY = date(2015, 1, 1)
+EMOJI = {"pos": "😊", "neu": "😐", "neg": "😢"}
+
+
+# ─── fixtures ───────────────────────────────────────────────────────
+def build_tiny_model(path, corpus):
+    """A 2-layer, 32-wide BERT classifier with a character vocabulary, saved to ``path``."""
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    os.makedirs(path, exist_ok=True)
+    chars = sorted(set("".join(corpus)) - set(" \n"))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars + ["##" + c for c in chars]
+    vocab_file = os.path.join(path, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    # Thai vowel and tone marks are combining characters; keep them
+    tok = BertTokenizerFast(vocab_file=vocab_file, do_lower_case=False, strip_accents=False,
+                            model_max_length=512)
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=512, num_labels=3,
+        id2label={0: "negative", 1: "neutral", 2: "positive"},
+        label2id={"negative": 0, "neutral": 1, "positive": 2},
+    )
+    BertForSequenceClassification(config).save_pretrained(path)
+    tok.save_pretrained(path)
+    return path
+
+
+def synthetic_rows(n, corpus, seed=0):
+    """``n`` diary rows, a few corpus sentences each, spread over ten years in date order."""
+    rng = random.Random(seed)
+    span = 3650
+    for i in range(n):
+        label = rng.choice(("pos", "neu", "neg"))
+        text = " ".join(rng.choice(corpus) for _ in range(rng.randint(1, 4)))
+        yield (str(uuid.UUID(int=rng.getrandbits(128))), (FIRST_DAY + timedelta(days=i * span // n)).isoformat(),
+               text, label, round(rng.uniform(0.34, 1.0), 4), EMOJI[label])
+
+
+def make_fixture(n, corpus, data_dir=DATA_DIR):
+    """Path of a store with ``n`` synthetic entries, built once and reused."""
+    from diary_store import DiaryStore
+
+    path = os.path.join(data_dir, f"diary-{n}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    tmp = path + ".building"
+    for f in (tmp, tmp + "-wal", tmp + "-shm"):
+        if os.path.exists(f):
+            os.remove(f)
+    DiaryStore(tmp)
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO entries (id, date, text, sentiment, score, emoji) VALUES (?, ?, ?, ?, ?, ?)",
+        synthetic_rows(n, corpus),
+    )
+    # aggregates and the search index are rebuilt by the next open
+    conn.execute("DELETE FROM meta WHERE key IN ('agg_version', 'search_version')")
+    conn.execute("COMMIT")
+    conn.close()
+    DiaryStore(tmp)
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+# ─── measuring ──────────────────────────────────────────────────────
+def summarize(latencies, items=1):
+    lat = sorted(latencies)
+    total = sum(lat)
+    return {
+        "n": len(lat),
+        "ops_per_s": round(items * len(lat) / total, 2) if total else None,
+        "p50_ms": round(statistics.median(lat) * 1000, 3),
+        "p99_ms": round(lat[min(len(lat) - 1, int(0.99 * len(lat)))] * 1000, 3),
+    }
+
+
+def measure(fn, repeat, warmup=1, items=1):
+    """Run ``fn(i)`` ``repeat`` times after ``warmup`` untimed calls."""
+    for i in range(warmup):
+        fn(-1 - i)
+    lat = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        lat.append(time.perf_counter() - t0)
+    return summarize(lat, items)
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _core(workdir, db_file, model_dir):
+    from diary_core import DiaryCore
+
+    return DiaryCore(db_file=db_file, csv_file=None, cache_file=os.path.join(workdir, "cache.db"),
+                     model_name=model_dir, backend="torch", warmup=False, rescore_stale=False,
+                     similar=False, archive_dir=None, workers=1)
+
+
+def bench_storage(n, corpus, model_dir, data_dir=DATA_DIR):
+    """Storage and Stats paths on an ``n``-entry diary; runs in its own process."""
+    from trend_figures import daily_mood, emoji_bar_figure
+
+    fixture = make_fixture(n, corpus, data_dir)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        db_file = os.path.join(workdir, "diary.db")
+        shutil.copy(fixture, db_file)
+        core = _core(workdir, db_file, model_dir)
+        store = core.store
+        end = FIRST_DAY + timedelta(days=3649)
+        rng = random.Random(1)
+        repeat = 20 if n <= 10_000 else 5 if n <= 100_000 else 3
+
+        def load_cold(i):
+            core.data_cache.invalidate()
+            core.load_data()
+
+        results["load_data"] = measure(load_cold, repeat)
+        results["load_data (cached)"] = measure(lambda i: core.load_data(), 200)
+
+        new_day = end + timedelta(days=1)
+        results["save_entry (insert)"] = measure(
+            lambda i: core.save_entry(new_day + timedelta(days=i + 10), corpus[i % len(corpus)], "pos", 0.9, "😊"),
+            200)
+        days = [FIRST_DAY + timedelta(days=rng.randrange(3650)) for _ in range(202)]
+        results["save_entry (update)"] = measure(
+            lambda i: core.save_entry(days[i], corpus[i % len(corpus)], "neg", 0.8, "😢"), 200)
+        ids = list(store.query_entries(limit=202, offset=n // 2)["id"])
+        results["delete_entry"] = measure(lambda i: core.delete_entry(ids[i]), min(200, len(ids) - 1))
+
+        year = (end - timedelta(days=364), end)
+        for label, (period, lo, hi) in {
+            "aggregates day/30d": ("day", end - timedelta(days=29), end),
+            "aggregates week/quarter": ("week", end - timedelta(days=90), end),
+            "aggregates month/year": ("month", *year),
+            "aggregates month/all": ("month", None, end),
+        }.items():
+            results[label] = measure(lambda i: store.aggregates(period, lo, hi), 50)
+        daily = store.aggregates("day", *year)
+        results["daily_mood/year"] = measure(lambda i: daily_mood(daily), 50)
+        results["emoji_bar_figure/year"] = measure(lambda i: emoji_bar_figure(daily), 20)
+        results["query_entries page"] = measure(lambda i: store.query_entries(limit=20, offset=(i % 50) * 20), 50)
+        results["count_entries pos"] = measure(lambda i: store.count_entries(sentiments=["pos"]), 50)
+        results["search"] = measure(lambda i: store.search(corpus[i % len(corpus)].split()[0], limit=50), 30)
+        core.close()
+    return {f"{n}/{k}": v for k, v in results.items()}, peak_rss_mb()
+
+
+def bench_inference(corpus, model_dir):
+    """analyze_sentiment through the cache, micro-batcher and tiny model; size-independent."""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        core = _core(workdir, os.path.join(workdir, "diary.db"), model_dir)
+        core.pipe.get()
+        texts = [f"{line} ({i})" for i, line in enumerate(corpus * 10)]
+        results["analyze_sentiment (miss)"] = measure(lambda i: core.analyze_sentiment(texts[i]), 200)
+        results["analyze_sentiment (hit)"] = measure(lambda i: core.analyze_sentiment(texts[i]), 200)
+        fresh = [f"{t} ใหม่" for t in texts]
+        results["analyze_many x32"] = measure(
+            lambda i: core.analyze_many(fresh[(i % 8) * 32:(i % 8 + 1) * 32]), 8, warmup=0, items=32)
+        long_text = " ".join(corpus * 6)
+        results["score_texts long entry"] = measure(lambda i: core.score_texts([long_text]), 20)
+    return {f"inference/{k}": v for k, v in results.items()}, peak_rss_mb()
+
+
+# ─── reporting ──────────────────────────────────────────────────────
+def compare(results, baseline, tolerance, min_delta_ms, p99_tolerance):
+    """``(regressions, missing)`` against the baseline's results.
+
+    A regression is ``(name, metric, before, after)`` for a p50 that grew by
+    more than ``tolerance`` or a p99 by more than ``p99_tolerance`` (either
+    also by more than ``min_delta_ms``); ``missing`` names the benchmarks
+    the baseline has no numbers for.
+    """
+    slower, missing = [], []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            missing.append(name)
+            continue
+        for metric, tol in (("p50_ms", tolerance), ("p99_ms", p99_tolerance)):
+            if metric in base and r[metric] > base[metric] * (1 + tol) and r[metric] - base[metric] > min_delta_ms:
+                slower.append((name, metric[:3], base[metric], r[metric]))
+    return slower, missing
+
+
+def compare_rss(rss, baseline_rss, tolerance):
+    """``(group, before, after)`` for every peak RSS that grew by more than ``tolerance``."""
+    return [(group, baseline_rss[group], mb) for group, mb in rss.items()
+            if group in baseline_rss and mb > baseline_rss[group] * (1 + tolerance)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    ap.add_argument("--corpus", default=CORPUS_FILE)
+    ap.add_argument("--data-dir", default=DATA_DIR, help="cached fixtures and the tiny model")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    ap.add_argument("--p99-tolerance", type=float, default=0.5, help="allowed p99 slowdown")
+    ap.add_argument("--rss-tolerance", type=float, default=0.2, help="allowed peak RSS growth")
+    ap.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore slowdowns smaller than this")
+    ap.add_argument("--no-inference", dest="inference", action="store_false")
+    ap.add_argument("--out", help="also write the results as JSON")
+    args = ap.parse_args(argv)
+
+    corpus = read_corpus(args.corpus)
+    # storage runs never load the model, so only the inference run needs it built
+    model_dir = os.path.abspath(os.path.join(args.data_dir, "tiny-model"))
+    if args.inference:
+        build_tiny_model(model_dir, corpus)
+    jobs = [(bench_storage, (n, corpus, model_dir, args.data_dir)) for n in args.sizes]
+    if args.inference:
+        jobs.append((bench_inference, (corpus, model_dir)))
+
+    results, rss = {}, {}
+    print(f"{'benchmark':<42} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for fn, fn_args in jobs:
+        # a fresh interpreter per size, so peak RSS belongs to that size alone
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            part, peak = pool.submit(fn, *fn_args).result()
+        group = next(iter(part)).split("/")[0]
+        rss[group] = peak
+        for name, r in part.items():
+            print(f"{name:<42} {r['ops_per_s'] or 0:>10.1f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+        print(f"{group + '/peak RSS':<42} {peak:>10.1f} MB")
+        results.update(part)
+
+    run = {"results": results, "peak_rss_mb": rss, "python": sys.version.split()[0]}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=1, ensure_ascii=False)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=1, ensure_ascii=False)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        # baselines are per machine; without one nothing could be flagged, so say so loudly
+        print(f"no baseline at {args.baseline}; record one on this machine with --save-baseline")
+        return 2
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    slower, missing = compare(results, baseline["results"], args.tolerance, args.min_delta_ms,
+                              args.p99_tolerance)
+    grown = compare_rss(rss, baseline.get("peak_rss_mb", {}), args.rss_tolerance)
+    for name in missing:
+        print(f"not in baseline, not compared: {name}")
+    for name, metric, before, after in slower:
+        print(f"REGRESSION {name}: {metric} {before:.3f} ms -> {after:.3f} ms ({after / before - 1:+.0%})")
+    for group, before, after in grown:
+        print(f"REGRESSION {group}/peak RSS: {before:.1f} MB -> {after:.1f} MB ({after / before - 1:+.0%})")
+    if slower or grown:
+        return 1
+    print(f"no regressions (p50 {args.tolerance:.0%}, p99 {args.p99_tolerance:.0%}, "
+          f"peak RSS {args.rss_tolerance:.0%}) against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
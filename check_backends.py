@@ -0,0 +1,62 @@
+"""Compare the int8 / ONNX sentiment backends against the fp32 baseline.
+
+    python check_backends.py                 # int8 and onnx vs torch
+    python check_backends.py --backends int8 --min-agreement 0.97
+
+Exits non-zero when label agreement or score drift exceed the thresholds.
+"""
+import argparse
+import sys
+import time
+
+from sentiment_backends import BACKENDS, classify, load_pipeline
+
+MODEL_NAME = "phoner45/wangchan-sentiment-thai-text-model"
+CORPUS_FILE = "thai_eval_corpus.txt"
+
+
+def read_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def score_all(backend, texts, model_name):
+    t0 = time.perf_counter()
+    pipe = load_pipeline(model_name, backend)
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    results = [classify(pipe, t) for t in texts]
+    return results, load_s, (time.perf_counter() - t0) / len(texts)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=MODEL_NAME)
+    ap.add_argument("--corpus", default=CORPUS_FILE)
+    ap.add_argument("--backends", nargs="+", default=["int8", "onnx"], choices=BACKENDS[1:])
+    ap.add_argument("--min-agreement", type=float, default=0.95)
+    ap.add_argument("--max-drift", type=float, default=0.05, help="max mean |score - baseline|")
+    args = ap.parse_args(argv)
+
+    texts = read_corpus(args.corpus)
+    baseline, load_s, per_text = score_all("torch", texts, args.model)
+    print(f"{'backend':<8} {'agree':>7} {'mean drift':>11} {'max drift':>10} {'load s':>8} {'ms/text':>8}")
+    print(f"{'torch':<8} {1:>7.1%} {0:>11.4f} {0:>10.4f} {load_s:>8.1f} {per_text * 1000:>8.1f}")
+
+    failed = False
+    for backend in args.backends:
+        results, load_s, per_text = score_all(backend, texts, args.model)
+        agree = sum(r[0] == b[0] for r, b in zip(results, baseline)) / len(texts)
+        # only compare scores where both backends picked the same label
+        drifts = [abs(r[1] - b[1]) for r, b in zip(results, baseline) if r[0] == b[0]]
+        mean_drift = sum(drifts) / len(drifts) if drifts else 1.0
+        max_drift = max(drifts, default=1.0)
+        ok = agree >= args.min_agreement and mean_drift <= args.max_drift
+        failed |= not ok
+        print(f"{backend:<8} {agree:>7.1%} {mean_drift:>11.4f} {max_drift:>10.4f} "
+              f"{load_s:>8.1f} {per_text * 1000:>8.1f}{'' if ok else '  FAIL'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import threading
+
+
+class VersionedCache:
+    """Process-wide memo of derived data, valid for one store generation.
+
+    ``get`` recomputes only when the store's version moved on (any write, from
+    any session or background worker) or after an explicit ``invalidate()``.
+    Cached values are shared between sessions and must not be mutated.
+    """
+
+    def __init__(self, version_fn, max_entries=256):
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self._version = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._rerun = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.reruns_saved = 0
+        self.reruns_computed = 0
+
+    def get(self, name, key, compute):
+        version = self.version_fn()
+        k = (name, key)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if k in self._entries:
+                self.hits += 1
+                return self._entries[k]
+            self.misses += 1
+        self._rerun.misses = getattr(self._rerun, "misses", 0) + 1
+        value = compute()
+        with self._lock:
+            if self._version == version:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[k] = value
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self.invalidations += 1
+
+    def start_rerun(self):
+        self._rerun.misses = 0
+
+    def end_rerun(self):
+        """Count a script run as saved when every lookup in it was a cache hit."""
+        saved = getattr(self._rerun, "misses", 0) == 0
+        with self._lock:
+            if saved:
+                self.reruns_saved += 1
+            else:
+                self.reruns_computed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self._version,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "reruns_saved": self.reruns_saved,
+                "reruns_computed": self.reruns_computed,
+            }
@@ -0,0 +1,396 @@
+"""Local HTTP API over diary_core, for scripts, integrations and load tests.
+
+    python diary_api.py [--host 127.0.0.1] [--port 8502]
+
+    GET    /health
+    GET    /stats
+    GET    /metrics?format=json           Prometheus text by default (SOUNDINJAI_METRICS=1)
+    POST   /score      {"texts": ["...", ...]}
+    POST   /entries    {"entries": [{"date": "2024-01-03", "text": "..."}], "wait": false}
+    GET    /entries?start=&end=&sentiment=pos,neg&limit=20&offset=0
+    GET    /entries/<id>
+    GET    /entries/<id>/similar?k=5    202 {"pending": true} until the entry is indexed
+    DELETE /entries/<id>
+    GET    /search?q=&start=&end=&sentiment=&limit=50
+    GET    /export?start=&end=            one JSON object per line (NDJSON), streamed
+
+All bodies and responses are JSON; batch requests share model batches with
+each other and with the Streamlit app when both run in one process.
+
+With ``--multi-user`` (or SOUNDINJAI_MULTI_USER=1) every request only ever
+touches its diarist's shard. The diarist comes from ``Authorization: Bearer
+<token>``, looked up in ``--tokens`` (SOUNDINJAI_API_TOKENS), a file of
+``<token> <user>`` lines. The ``X-Diary-User`` header or ``?user=`` parameter
+is honoured only with SOUNDINJAI_TRUST_USER_NAME=1, i.e. behind a proxy that
+authenticates users and sets the header, or on a trusted network; the server
+refuses to start in multi-user mode with neither.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import date as _date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from diary_core import MULTI_USER, TRUST_USER_NAME, UserCores, get_core, get_user_cores
+from diary_store import PENDING
+from metrics import METRICS
+from micro_batcher import BatcherOverloaded
+from sentiment_backends import EMOJI_MAP
+
+log = logging.getLogger(__name__)
+
+MAX_BATCH = 1000
+# unread bodies up to this size are skipped before an error reply; larger ones close the connection
+MAX_DISCARD = 1 << 20
+EXPORT_CHUNK = 1000
+API_TOKENS = os.environ.get("SOUNDINJAI_API_TOKENS") or None
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_date(value, name):
+    if value is None or value == "":
+        return None
+    try:
+        return _date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be an ISO date (YYYY-MM-DD), got {value!r}") from None
+
+
+def _int_param(query, name, default, lo, hi):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer") from None
+    return max(lo, min(hi, value))
+
+
+def _sentiments(query):
+    return [s for v in query.get("sentiment", []) for s in v.split(",") if s]
+
+
+def _batch(body, key):
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, f"expected a non-empty list in {key!r}")
+    if len(items) > MAX_BATCH:
+        raise ApiError(413, f"at most {MAX_BATCH} {key} per request")
+    return items
+
+
+def _result(label, score):
+    return {"sentiment": label, "score": score, "emoji": EMOJI_MAP[label]}
+
+
+class DiaryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SoundInJai"
+    core = None
+    users = None
+    tokens = {}
+    trust_user_name = False
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    # ─── plumbing ──────────────────────────────────────────────────
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type="text/plain; version=0.0.4; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # the body's end is unknown, so nothing after it on this connection can be parsed
+            self.close_connection = True
+            raise ApiError(400, f"invalid Content-Length: {self.headers.get('Content-Length')!r}")
+        return length
+
+    def _read_json(self):
+        self._body_read = True
+        length = self._content_length()
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise ApiError(400, f"invalid JSON body: {exc}") from None
+
+    def _discard_body(self):
+        # keep-alive: a body left unread would be parsed as the next request
+        if self._body_read:
+            return
+        self._body_read = True
+        try:
+            length = self._content_length()
+        except ApiError:
+            return
+        if length > MAX_DISCARD:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+
+    def _fail(self, status, message):
+        if self._streaming:
+            # part of a chunked body is already out; cutting the stream short is the only signal left
+            self.close_connection = True
+            return
+        self._discard_body()
+        self._send_json(status, {"error": message})
+
+    def _user(self, query):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer ") and self.tokens:
+            user = self.tokens.get(auth[len("Bearer "):].strip())
+            if user is None:
+                raise ApiError(401, "unknown API token")
+            return user
+        if self.trust_user_name:
+            user = self.headers.get("X-Diary-User") or query.get("user", [""])[0]
+            if user:
+                return user
+        raise ApiError(401, "missing Authorization: Bearer <token> (multi-user mode)")
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+        route = getattr(self, f"{method}_{parts[0]}" if parts else "", None)
+        self._body_read = False
+        self._streaming = False
+        try:
+            if route is None:
+                raise ApiError(404, f"no route for {method.upper()} {url.path}")
+            if self.users is not None and route.__name__ not in ("get_health", "get_metrics"):
+                self.core = self.users.get(self._user(query))
+            route(parts[1:], query)
+            self._discard_body()
+        except ApiError as exc:
+            self._fail(exc.status, str(exc))
+        except BatcherOverloaded as exc:
+            self._fail(503, str(exc))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception:
+            # sqlite locked, archive/pyarrow errors, ...: answer instead of dropping the connection
+            log.exception("%s %s failed", method.upper(), url.path)
+            self._fail(500, "internal error")
+
+    def do_GET(self):
+        self._dispatch("get")
+
+    def do_POST(self):
+        self._dispatch("post")
+
+    def do_DELETE(self):
+        self._dispatch("delete")
+
+    # ─── routes ────────────────────────────────────────────────────
+    def get_health(self, args, query):
+        self._send_json(200, {"status": "ok", "model_loaded": self.core.pipe.loaded,
+                              "model_version": self.core.model_version})
+
+    def get_stats(self, args, query):
+        core = self.core
+        self._send_json(200, {
+            "entries": core.store.count(),
+            "stale": core.store.count_stale(core.model_version),
+            "pending": core.inference_queue.pending_count(),
+            "sentiment_cache": core.sentiment_cache.stats(),
+            "micro_batcher": core.batcher.stats(),
+            "data_cache": core.data_cache.stats(),
+            **({"users": self.users.stats()} if self.users is not None else {}),
+        })
+
+    def get_metrics(self, args, query):
+        # process-wide, so the same in multi-user mode; scraped without a user header
+        if not METRICS.enabled:
+            raise ApiError(404, "metrics are disabled (set SOUNDINJAI_METRICS=1)")
+        if query.get("format", [""])[0] == "json":
+            return self._send_json(200, METRICS.snapshot())
+        self._send_text(200, METRICS.prometheus_text())
+
+    def post_score(self, args, query):
+        texts = _batch(self._read_json(), "texts")
+        if not all(isinstance(t, str) for t in texts):
+            raise ApiError(400, "texts must be strings")
+        results = self.core.analyze_many(texts)
+        self._send_json(200, {"results": [_result(*r) for r in results]})
+
+    def post_entries(self, args, query):
+        body = self._read_json()
+        entries = []
+        for item in _batch(body, "entries"):
+            if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+                raise ApiError(400, "each entry needs a 'date' and a 'text' string")
+            entries.append((_parse_date(item.get("date"), "date") or _date.today(), item["text"]))
+        saved = self.core.save_many(entries, wait=bool(body.get("wait")))
+        self._send_json(200, {"entries": [
+            {"id": eid, **(_result(*r) if r else {"sentiment": PENDING})} for eid, r in saved
+        ]})
+
+    def get_entries(self, args, query):
+        if args:
+            entry = self.core.store.get_entry(args[0])
+            if entry is None:
+                raise ApiError(404, f"no entry {args[0]}")
+            if args[1:] == ["similar"]:
+                return self._send_similar(entry, query)
+            return self._send_json(200, entry)
+        sentiments = _sentiments(query)
+        start = _parse_date(query.get("start", [None])[0], "start")
+        end = _parse_date(query.get("end", [None])[0], "end")
+        df = self.core.store.query_entries(
+            start, end, sentiments or None,
+            limit=_int_param(query, "limit", 20, 1, MAX_BATCH),
+            offset=_int_param(query, "offset", 0, 0, sys.maxsize),
+        )
+        self._send_json(200, {
+            "total": self.core.store.count_entries(start, end, sentiments or None),
+            "entries": df.to_dict("records"),
+        })
+
+    def _send_similar(self, entry, query):
+        if self.core.embeddings is None:
+            raise ApiError(404, "similar entries are disabled (SOUNDINJAI_SIMILAR=0 or onnx backend)")
+        hits = self.core.similar_entries(entry["id"], entry["text"], k=_int_param(query, "k", 5, 1, 100))
+        if hits is None:
+            # queued for the background indexer; ask again shortly
+            return self._send_json(202, {"pending": True})
+        self._send_json(200, {"entries": [{**e, "similarity": sim} for e, sim in hits]})
+
+    def get_search(self, args, query):
+        q = query.get("q", [""])[0]
+        if not q.strip():
+            raise ApiError(400, "missing search query 'q'")
+        sentiments = _sentiments(query)
+        df = self.core.store.search(
+            q,
+            _parse_date(query.get("start", [None])[0], "start"),
+            _parse_date(query.get("end", [None])[0], "end"),
+            sentiments or None,
+            limit=_int_param(query, "limit", 50, 1, MAX_BATCH),
+        )
+        self._send_json(200, {"entries": df.to_dict("records")})
+
+    def delete_entries(self, args, query):
+        if len(args) != 1:
+            raise ApiError(404, "DELETE /entries/<id>")
+        if self.core.store.get_entry(args[0]) is None:
+            raise ApiError(404, f"no entry {args[0]}")
+        self.core.delete_entry(args[0])
+        self._send_json(200, {"deleted": args[0]})
+
+    def get_export(self, args, query):
+        rows = self.core.store.iter_rows(
+            _parse_date(query.get("start", [None])[0], "start"),
+            _parse_date(query.get("end", [None])[0], "end"),
+            chunk_size=EXPORT_CHUNK,
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._streaming = True
+        buf = []
+        for row in rows:
+            buf.append(json.dumps(row, ensure_ascii=False))
+            if len(buf) >= EXPORT_CHUNK:
+                self._write_chunk(buf)
+        if buf:
+            self._write_chunk(buf)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, lines):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        lines.clear()
+
+
+def load_tokens(path):
+    """``{token: user}`` from a file of ``<token> <user>`` lines; ``#`` starts a comment."""
+    tokens = {}
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                token, user = line.split(None, 1)
+            except ValueError:
+                raise ValueError(f"{path}:{n}: expected '<token> <user>'") from None
+            tokens[token] = user.strip()
+    return tokens
+
+
+def make_server(host="127.0.0.1", port=8502, core=None, verbose=False, multi_user=MULTI_USER,
+                tokens=API_TOKENS, trust_user_name=TRUST_USER_NAME):
+    users = None
+    if isinstance(tokens, str):
+        tokens = load_tokens(tokens)
+    if multi_user:
+        if not tokens and not trust_user_name:
+            raise ValueError("multi-user mode needs API tokens (--tokens / SOUNDINJAI_API_TOKENS) "
+                             "or SOUNDINJAI_TRUST_USER_NAME=1 behind an authenticating proxy")
+        users = UserCores(core) if core is not None else get_user_cores()
+    handler = type("Handler", (DiaryHandler,), {
+        "core": core or get_core(), "users": users,
+        "tokens": tokens or {}, "trust_user_name": trust_user_name,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8502)
+    ap.add_argument("--verbose", action="store_true", help="log every request")
+    ap.add_argument("--multi-user", action="store_true", default=MULTI_USER,
+                    help="one shard per authenticated user instead of the single diary")
+    ap.add_argument("--tokens", default=API_TOKENS, metavar="FILE",
+                    help="'<token> <user>' lines mapping bearer tokens to diarists (multi-user mode)")
+    args = ap.parse_args(argv)
+
+    try:
+        server = make_server(args.host, args.port, verbose=args.verbose,
+                             multi_user=args.multi_user, tokens=args.tokens)
+    except (OSError, ValueError) as exc:
+        ap.error(str(exc))
+    print(f"diary API on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
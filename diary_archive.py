@@ -0,0 +1,410 @@
+"""Columnar diary archive, partitioned by year and month.
+
+    python diary_archive.py export archive/ [--format parquet|arrow] [--start 2023-01-01] [--end ...]
+    python diary_archive.py import archive/ [--start ...] [--end ...]
+    python diary_archive.py convert-csv diary_records.csv archive/
+    python diary_archive.py info archive/
+
+Entries are stored one directory per month (``year=2024/month=01/``, hive
+style) as Parquet or uncompressed Arrow IPC files. Reads go through
+``pyarrow.dataset`` on a memory-mapping filesystem: partitions outside the
+requested dates are never opened and only the requested columns are read,
+so a Calendar month touches one directory and two columns. Arrow IPC files
+are mapped without a copy; Parquet is smaller on disk but decoded on read.
+
+Needs pyarrow (``pip install pyarrow``). Point the app at an archive with
+``SOUNDINJAI_ARCHIVE=archive/`` to browse it in the Calendar and Stats tabs.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import uuid
+from collections import defaultdict
+from datetime import date as _date, timedelta
+
+import pandas as pd
+
+from diary_store import COLUMNS, PENDING, PERIODS, DiaryStore, clean_csv_frame
+
+FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+ARCHIVE_COLUMNS = COLUMNS + ["model_version"]
+MANIFEST = "_manifest.json"
+READ_RETRIES = 3
+# rows per file; a month bigger than this (many users) is split into several parts
+ROWS_PER_PART = 250_000
+CSV_CHUNK = 100_000
+
+
+def _pa():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.fs as pafs
+        import pyarrow.ipc  # noqa: F401  (registers pa.ipc)
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError("the columnar archive needs pyarrow: pip install pyarrow") from exc
+    return pa, ds, pafs
+
+
+def _schema(pa):
+    return pa.schema([
+        ("id", pa.string()),
+        ("date", pa.date32()),
+        ("text", pa.string()),
+        ("sentiment", pa.string()),
+        ("score", pa.float64()),
+        ("emoji", pa.string()),
+        ("model_version", pa.string()),
+    ])
+
+
+def _month_dir(year, month):
+    return os.path.join(f"year={year}", f"month={month:02d}")
+
+
+def _text(value):
+    # pandas hands blank CSV cells over as NaN, which pa.string() rejects
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else str(value)
+
+
+def _bucket_span(period, start, end):
+    """Widen ``start``..``end`` to whole buckets, matching ``DiaryStore.aggregates``."""
+    if start is not None:
+        if period == "week":
+            start = start - timedelta(days=start.weekday())
+        elif period == "month":
+            start = start.replace(day=1)
+    if end is not None:
+        if period == "week":
+            end = end + timedelta(days=6 - end.weekday())
+        elif period == "month":
+            nxt = end.replace(day=28) + timedelta(days=4)
+            end = nxt - timedelta(days=nxt.day)
+    return start, end
+
+
+class DiaryArchive:
+    """A directory of month partitions plus a small JSON manifest.
+
+    The manifest records the file format and a generation counter that every
+    write bumps; ``version()`` exposes it as a cache key like
+    ``DiaryStore.version``.
+    """
+
+    def __init__(self, root, fmt=None):
+        self.root = os.path.abspath(root)
+        manifest = self._manifest()
+        if fmt is None:
+            fmt = manifest.get("format", "parquet")
+        elif manifest.get("format") not in (None, fmt):
+            raise ValueError(f"{root} holds {manifest['format']!r} files, not {fmt!r}")
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown archive format {fmt!r}, expected one of {tuple(FORMATS)}")
+        self.fmt = fmt
+        self._dataset = None
+        self._dataset_version = None
+
+    # ─── manifest ──────────────────────────────────────────────────
+    def _manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def version(self):
+        return self._manifest().get("generation", 0)
+
+    def months(self):
+        """``{"2024-01": rows, ...}`` for every partition in the archive."""
+        return self._manifest().get("months", {})
+
+    # ─── writing ───────────────────────────────────────────────────
+    def write(self, rows, rows_per_part=ROWS_PER_PART, drop=()):
+        """Write entry dicts (``ARCHIVE_COLUMNS``), replacing every month they fall in.
+
+        New files get names of their own next to the old ones and only go
+        live when the manifest, which lists every live file, is replaced in
+        one rename. Readers build their dataset from that list, so they see
+        either all old or all new months, never a missing one. Files a write
+        replaces are deleted by the next write, so a scan still running on
+        the previous manifest can finish. Months in ``drop`` (``"2024-01"``
+        keys) that received no rows are removed. Returns the number of rows
+        written.
+        """
+        pa, _, _ = _pa()
+        schema = _schema(pa)
+        manifest = self._manifest()
+        generation = manifest.get("generation", 0) + 1
+        tag = f"g{generation:06d}-{uuid.uuid4().hex[:6]}"
+        buffers = defaultdict(list)
+        written = defaultdict(list)
+        counts = defaultdict(int)
+
+        def flush(key):
+            year, month = key
+            table = pa.Table.from_pylist(buffers.pop(key), schema=schema)
+            rel = os.path.join(_month_dir(year, month), f"{tag}-part-{len(written[key]):05d}{EXTENSIONS[self.fmt]}")
+            path = os.path.join(self.root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            written[key].append(rel)
+            if self.fmt == "parquet":
+                pa.parquet.write_table(table, path, compression="zstd")
+            else:
+                # uncompressed IPC, so a memory-mapped read needs no decoding or copy
+                with pa.ipc.new_file(path, schema) as writer:
+                    writer.write_table(table)
+
+        try:
+            for r in rows:
+                d = r["date"]
+                if not isinstance(d, _date):
+                    d = _date.fromisoformat(str(d)[:10])
+                key = (d.year, d.month)
+                buffers[key].append({
+                    "id": str(r["id"]), "date": d, "text": _text(r.get("text")) or "",
+                    "sentiment": _text(r.get("sentiment")), "score": float(r.get("score") or 0.0),
+                    "emoji": _text(r.get("emoji")), "model_version": _text(r.get("model_version")),
+                })
+                counts[key] += 1
+                if len(buffers[key]) >= rows_per_part:
+                    flush(key)
+            for key in list(buffers):
+                flush(key)
+        except BaseException:
+            # nothing was published; the half-written files are listed nowhere
+            self._remove_files(rel for rels in written.values() for rel in rels)
+            raise
+
+        files = self._files(manifest)
+        months = manifest.setdefault("months", {})
+        retired = []
+        for (year, month), n in sorted(counts.items()):
+            key = f"{year}-{month:02d}"
+            retired += files.get(key, [])
+            files[key] = written[(year, month)]
+            months[key] = n
+        for key in set(drop) - {f"{y}-{m:02d}" for y, m in counts}:
+            retired += files.pop(key, [])
+            months.pop(key, None)
+        # no manifest a reader can still hold lists what the previous write retired
+        previous = manifest.get("retired", [])
+        manifest.update(format=self.fmt, generation=generation, files=files, retired=retired)
+        self._save_manifest(manifest)
+        self._remove_files(previous)
+        return sum(counts.values())
+
+    def _files(self, manifest):
+        """``{"2024-01": [relative file paths], ...}`` from the manifest."""
+        return {key: list(rels) for key, rels in manifest.get("files", {}).items()}
+
+    def _remove_files(self, rels):
+        dirs = set()
+        for rel in rels:
+            path = os.path.join(self.root, rel)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            dirs.add(os.path.dirname(path))
+        # month and then year directories that are now empty
+        for d in sorted(dirs | {os.path.dirname(d) for d in dirs}, key=len, reverse=True):
+            try:
+                os.rmdir(d)
+            except OSError:
+                pass
+
+    def export_store(self, store, start=None, end=None):
+        """Copy the store's entries (optionally one date range) into the archive.
+
+        Months in the range are rewritten whole, so widen ``start``/``end``
+        to month boundaries to avoid dropping the rest of a partly covered month.
+        """
+        start, end = _bucket_span("month", start, end)
+        lo = f"{start.year}-{start.month:02d}" if start else ""
+        hi = f"{end.year}-{end.month:02d}" if end else "9999"
+        # months whose entries were all deleted since the last export
+        drop = [m for m in self.months() if lo <= m <= hi]
+        return self.write(store.iter_rows(start, end), drop=drop)
+
+    def import_into(self, store, start=None, end=None, chunk_size=10_000):
+        """Insert or replace archived entries in ``store`` by id; returns how many."""
+        n = 0
+        for batch in self.iter_batches(ARCHIVE_COLUMNS, start, end, chunk_size):
+            n += store.import_rows(batch.to_pylist())
+        return n
+
+    # ─── reading ───────────────────────────────────────────────────
+    def _ds(self):
+        pa, ds, pafs = _pa()
+        manifest = self._manifest()
+        version = manifest.get("generation", 0)
+        if self._dataset is None or self._dataset_version != version:
+            parts = pa.schema([("year", pa.int32()), ("month", pa.int32())])
+            # exactly the files of one manifest: a concurrent write's new files
+            # and the ones it retires are never mixed into the same scan
+            files = [os.path.join(self.root, rel) for rels in self._files(manifest).values() for rel in rels]
+            self._dataset = ds.dataset(
+                files,
+                partition_base_dir=self.root,
+                schema=pa.unify_schemas([_schema(pa), parts]),
+                format=FORMATS[self.fmt],
+                partitioning=ds.partitioning(parts, flavor="hive"),
+                # IPC files are mapped rather than read into buffers
+                filesystem=pafs.LocalFileSystem(use_mmap=True),
+            )
+            self._dataset_version = version
+        return self._dataset
+
+    @staticmethod
+    def _filter(ds, start, end):
+        expr = None
+
+        def both(a, b):
+            return b if a is None else a & b
+
+        year, month, day = ds.field("year"), ds.field("month"), ds.field("date")
+        # the year/month terms prune whole partitions before any file is opened
+        if start is not None:
+            expr = both(expr, (year > start.year) | ((year == start.year) & (month >= start.month)))
+            expr = both(expr, day >= start)
+        if end is not None:
+            expr = both(expr, (year < end.year) | ((year == end.year) & (month <= end.month)))
+            expr = both(expr, day <= end)
+        return expr
+
+    def read_table(self, columns=None, start=None, end=None):
+        """An Arrow table of ``columns`` for entries dated ``start``..``end``."""
+        _, ds, _ = _pa()
+        for attempt in range(READ_RETRIES):
+            try:
+                return self._ds().to_table(columns=columns or ARCHIVE_COLUMNS, filter=self._filter(ds, start, end))
+            except FileNotFoundError:
+                # two writes landed during this scan and removed files of its
+                # manifest; start over from the current one
+                if attempt == READ_RETRIES - 1:
+                    raise
+                self._dataset = None
+
+    def iter_batches(self, columns=None, start=None, end=None, batch_size=10_000):
+        _, ds, _ = _pa()
+        yield from self._ds().to_batches(columns=columns or ARCHIVE_COLUMNS,
+                                         filter=self._filter(ds, start, end), batch_size=batch_size)
+
+    def load_frame(self, start=None, end=None, columns=None):
+        """Like ``DiaryStore.load_frame``, but only for the partitions in range."""
+        df = self.read_table(columns or COLUMNS, start, end).to_pandas(date_as_object=True)
+        if "score" in df:
+            df["score"] = df["score"].fillna(0.0)
+        return df
+
+    def count(self, start=None, end=None):
+        if start is None and end is None:
+            return sum(self.months().values())
+        return self.read_table(["date"], start, end).num_rows
+
+    def emoji_by_date(self, start, end):
+        """``{date: emoji}`` for ``start``..``end``; the latest archived row wins on duplicate dates."""
+        table = self.read_table(["date", "emoji"], start, end)
+        return dict(zip(table.column("date").to_pylist(), table.column("emoji").to_pylist()))
+
+    def aggregates(self, period, start=None, end=None):
+        """Same frame as ``DiaryStore.aggregates``, computed from the partitions in range."""
+        if period not in PERIODS:
+            raise ValueError(f"unknown period {period!r}, expected one of {PERIODS}")
+        lo, hi = _bucket_span(period, start, end)
+        df = self.load_frame(lo, hi, columns=["date", "sentiment", "emoji", "score"])
+        df = df[df["sentiment"].notna() & (df["sentiment"] != PENDING)]
+        cols = ["bucket", "sentiment", "emoji", "n", "score_sum"]
+        if df.empty:
+            return pd.DataFrame(columns=cols)
+        d = pd.to_datetime(df["date"])
+        if period == "day":
+            bucket = d.dt.strftime("%Y-%m-%d")
+        elif period == "month":
+            bucket = d.dt.strftime("%Y-%m")
+        else:
+            iso = d.dt.isocalendar()
+            bucket = iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)
+        out = (
+            df.assign(bucket=bucket.values, emoji=df["emoji"].fillna(""))
+            .groupby(["bucket", "sentiment", "emoji"], sort=True)
+            .agg(n=("score", "size"), score_sum=("score", "sum"))
+            .reset_index()
+        )
+        return out[cols]
+
+
+def convert_csv(csv_path, archive, chunksize=CSV_CHUNK):
+    """Write a legacy ``diary_records.csv`` into ``archive`` without loading it whole.
+
+    The CSV is read ``chunksize`` rows at a time and cleaned like the SQLite
+    import; every month it covers is replaced.
+    """
+    def rows():
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            df = clean_csv_frame(chunk)
+            df["model_version"] = None
+            yield from df[ARCHIVE_COLUMNS].to_dict("records")
+
+    return archive.write(rows())
+
+
+def _date_arg(value):
+    return _date.fromisoformat(value)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ep = sub.add_parser("export", help="copy entries from the SQLite store into the archive")
+    ep.add_argument("archive")
+    ep.add_argument("--format", choices=FORMATS, help="file format of a new archive (default parquet)")
+    ip = sub.add_parser("import", help="insert or replace archived entries in the SQLite store")
+    ip.add_argument("archive")
+    for p in (ep, ip):
+        p.add_argument("--db", default="diary_records.db")
+        p.add_argument("--csv", default="diary_records.csv", help="legacy CSV imported on first use")
+        p.add_argument("--start", type=_date_arg)
+        p.add_argument("--end", type=_date_arg)
+    cp = sub.add_parser("convert-csv", help="write a diary_records.csv straight into an archive")
+    cp.add_argument("csv")
+    cp.add_argument("archive")
+    cp.add_argument("--format", choices=FORMATS)
+    fp = sub.add_parser("info", help="partitions and row counts")
+    fp.add_argument("archive")
+    args = ap.parse_args(argv)
+
+    archive = DiaryArchive(args.archive, getattr(args, "format", None))
+    if args.cmd == "export":
+        n = archive.export_store(DiaryStore(args.db, csv_path=args.csv), args.start, args.end)
+        print(f"exported {n} entries to {archive.root} ({archive.fmt})")
+    elif args.cmd == "import":
+        n = archive.import_into(DiaryStore(args.db, csv_path=args.csv), args.start, args.end)
+        print(f"imported {n} entries into {args.db}")
+    elif args.cmd == "convert-csv":
+        n = convert_csv(args.csv, archive)
+        print(f"converted {n} rows from {args.csv} into {archive.root} ({archive.fmt})")
+    else:
+        months = archive.months()
+        for month, n in sorted(months.items()):
+            print(f"{month}  {n:>9}")
+        print(f"{len(months)} partitions, {sum(months.values())} entries, format {archive.fmt}, "
+              f"generation {archive.version()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
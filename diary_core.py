@@ -0,0 +1,500 @@
+"""Diary engine without any Streamlit dependency.
+
+Storage, sentiment scoring and suggestions live here so the Streamlit app,
+the local HTTP API (diary_api.py) and scripts all drive the same code.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import metrics
+from data_cache import VersionedCache
+from embedding_index import EmbeddingIndex, EmbeddingIndexer
+from diary_store import PENDING, DiaryStore
+from duty_cycle import run_duty_cycled
+from inference_queue import InferenceQueue
+from micro_batcher import MicroBatcher
+from sentiment_backends import (
+    EMOJI_MAP, LONG_TEXT_VARIANT,
+    LazyPipeline, classify_batch, classify_long, count_tokens, embed_texts, model_fingerprint,
+)
+from sentiment_cache import SentimentCache
+from stale_rescorer import StaleRescorer
+
+log = logging.getLogger(__name__)
+
+# ─── CONFIG ─────────────────────────────────────────────────────────
+DATA_FILE = "diary_records.csv"
+DB_FILE = "diary_records.db"
+CACHE_FILE = "sentiment_cache.db"
+EMBED_FILE = "diary_embeddings.npy"
+MODEL_NAME = os.environ.get("SOUNDINJAI_MODEL", "phoner45/wangchan-sentiment-thai-text-model")
+SENTIMENT_BACKEND = os.environ.get("SOUNDINJAI_BACKEND", "torch")  # torch | int8 | onnx
+WARMUP_MODEL = os.environ.get("SOUNDINJAI_WARMUP", "1") == "1"
+LONG_TEXT = os.environ.get("SOUNDINJAI_LONG_TEXT", "1") == "1"
+RESCORE_STALE = os.environ.get("SOUNDINJAI_RESCORE_STALE", "1") == "1"
+# "Days like today" needs the encoder's hidden states, which the onnx graph does not expose
+SIMILAR_ENTRIES = os.environ.get("SOUNDINJAI_SIMILAR", "1") == "1"
+EMBED_DTYPE = os.environ.get("SOUNDINJAI_EMBED_DTYPE", "float32")
+# optional columnar archive (diary_archive.py) that Calendar and Stats can read instead
+ARCHIVE_DIR = os.environ.get("SOUNDINJAI_ARCHIVE") or None
+# hosted mode: one SQLite shard per user under USERS_DIR, model shared by all of them
+MULTI_USER = os.environ.get("SOUNDINJAI_MULTI_USER", "0") == "1"
+USERS_DIR = os.environ.get("SOUNDINJAI_USERS_DIR", "users")
+# without sign-in the shard comes from a name anyone can type or send: only for a trusted
+# network, or behind a proxy that authenticates users and sets X-Diary-User itself
+TRUST_USER_NAME = os.environ.get("SOUNDINJAI_TRUST_USER_NAME", "0") == "1"
+# per-user engines kept open (connections, background threads); the rest are reopened on demand
+MAX_OPEN_USERS = int(os.environ.get("SOUNDINJAI_MAX_OPEN_USERS", "64"))
+PENDING_EMOJI = "⏳"
+# several in-flight jobs let the micro-batcher coalesce them into one forward pass
+INFERENCE_WORKERS = 4
+BATCH_MAX = int(os.environ.get("SOUNDINJAI_BATCH_MAX", "16"))
+BATCH_WAIT_MS = float(os.environ.get("SOUNDINJAI_BATCH_WAIT_MS", "5"))
+
+SUGGESTIONS = {
+    "pos": [
+        "วันนี้คุณดูสดใสมาก! 🌟 ลองแบ่งปันรอยยิ้มให้คนรอบข้างดูสิ",
+        "รักษาความรู้สึกดี ๆ แบบนี้ไว้นาน ๆ นะ 😊",
+        "เยี่ยมเลย! เก็บโมเมนต์ดี ๆ ไว้ในใจ ❤️"
+    ],
+    "neu": [
+        "วันกลาง ๆ ก็โอเคนะ ลองทำสิ่งใหม่ ๆ ดูไหม?",
+        "ลองเขียนหาอะไรทำดูสิ เช่นเล่นเกม ดูหนัง อาจทำให้รู้สึกดีขึ้น",
+        "อารมณ์นิ่ง ๆ แบบนี้ ลองฟังเพลงชิล ๆ ก็ไม่เลวนะ"
+    ],
+    "neg": [
+        "คุณเก่งมาก วันนี้พยายามได้ดีมากได้เวลาพักผ่อนนน อย่าลืมฟังเพลงโปรดก่อนนอนละ",
+        "ส่งกำลังใจให้คุณผ่านวันนี้ไปได้ ✨",
+        "อย่าลืมหายใจลึก ๆ แล้วค่อย ๆ ก้าวต่อไปนะ 💛"
+    ]
+}
+
+
+def suggest_message(sentiment, score):
+    return random.choice(SUGGESTIONS[sentiment])
+
+
+class DiaryCore:
+    """Everything one process needs to store and score diary entries.
+
+    With ``shared`` (another core) the model, sentiment cache, micro-batcher
+    and inference threads are borrowed from it, and only storage is this
+    core's own; that is how each user's shard gets its engine. With ``wake``
+    the stale re-scorer and embedding indexer get no threads of their own:
+    whoever owns the event drives them through ``background_step`` and is
+    woken by fresh saves. With no ``db_file`` the core only holds the model,
+    sentiment cache, micro-batcher and inference pool for shards to borrow:
+    no store, no background jobs.
+    """
+
+    def __init__(self, db_file=DB_FILE, csv_file=DATA_FILE, cache_file=CACHE_FILE,
+                 model_name=MODEL_NAME, backend=SENTIMENT_BACKEND, long_text=LONG_TEXT,
+                 warmup=WARMUP_MODEL, rescore_stale=RESCORE_STALE, workers=INFERENCE_WORKERS,
+                 embed_file=EMBED_FILE, similar=SIMILAR_ENTRIES, archive_dir=ARCHIVE_DIR,
+                 shared=None, loader=None, wake=None):
+        if shared is not None:
+            model_name, backend = shared.pipe.model_name, shared.backend
+            long_text, warmup = shared.long_text, shared.warmup
+        self.backend = backend
+        self.long_text = long_text
+        self.warmup = warmup
+        self.model_version = model_fingerprint(model_name, backend, LONG_TEXT_VARIANT if long_text else "")
+
+        if shared is not None:
+            self.pipe = shared.pipe
+            self.sentiment_cache = shared.sentiment_cache
+            self.batcher = shared.batcher
+        else:
+            # transformers/torch are imported on first inference (or by the warm-up
+            # thread), never while a caller is waiting for the first response
+            self.pipe = LazyPipeline(model_name, backend, loader)
+            if warmup:
+                self.pipe.warm_up()
+            # backends and label mappings disagree slightly, so key on the full fingerprint
+            self.sentiment_cache = SentimentCache(cache_file, self.model_version)
+            self.batcher = MicroBatcher(self.score_texts, max_batch=BATCH_MAX, max_wait_ms=BATCH_WAIT_MS)
+
+        self.rescore_stale = rescore_stale
+        self.archive = None
+        self.archive_cache = None
+        self.embeddings = None
+        self.embedding_indexer = None
+        if db_file is None:
+            self.store = self.data_cache = self.stale_rescorer = None
+            # only the pool and its job count, which the shards' queues share
+            self.inference_queue = InferenceQueue(self.analyze_sentiment, None, EMOJI_MAP, workers=workers,
+                                                  model_version=self.model_version)
+            return
+
+        # diary_records.csv is imported into the database once, on first start
+        self.store = DiaryStore(db_file, csv_path=csv_file)
+        self.data_cache = VersionedCache(self.store.version)
+        self.inference_queue = InferenceQueue(
+            self.analyze_sentiment, self.store, EMOJI_MAP, workers=workers,
+            model_version=self.model_version,
+            pool=shared.inference_queue if shared is not None else None,
+        )
+        self.inference_queue.resume_pending()
+        # yields to interactive saves of every user, and rides the shared micro-batcher
+        self.stale_rescorer = StaleRescorer(
+            self.store,
+            self.batcher.submit_many,
+            EMOJI_MAP,
+            self.model_version,
+            busy=self.busy,
+        )
+        if rescore_stale and wake is None:
+            self.stale_rescorer.start()
+
+        if archive_dir:
+            from diary_archive import DiaryArchive
+
+            self.archive = DiaryArchive(archive_dir)
+            self.archive_cache = VersionedCache(self.archive.version)
+
+        if similar and backend != "onnx":
+            self.embeddings = EmbeddingIndex(embed_file, f"{model_name}|{backend}", EMBED_DTYPE)
+            self.embedding_indexer = EmbeddingIndexer(
+                self.store,
+                self.embeddings,
+                self.embed,
+                # never the reason the model gets loaded, and yields to interactive saves
+                busy=lambda: not self.pipe.loaded or self.busy(),
+                wake=wake,
+            )
+            if wake is None:
+                self.embedding_indexer.start()
+
+    def busy(self):
+        """True while interactive scoring is queued for any core on the shared pool."""
+        return self.inference_queue.pool_pending() > 0
+
+    def background_step(self):
+        """One batch of stale re-scoring and embedding for a caller-driven core.
+
+        Returns rows processed, or -1 when neither job has anything left.
+        """
+        n = self.stale_rescorer.run_once() if self.rescore_stale else 0
+        more = n > 0
+        if self.embedding_indexer is not None and self.pipe.loaded:
+            m = self.embedding_indexer.run_once()
+            more = more or m >= 0
+            n += max(m, 0)
+        return n if more else -1
+
+    def idle(self):
+        """No saves of this core waiting to be scored or embedded."""
+        return self.inference_queue.pending_count() == 0 and (
+            self.embedding_indexer is None or self.embedding_indexer.pending() == 0)
+
+    def close(self):
+        """Stop this core's background jobs and close its files; shared model parts keep running."""
+        if self.store is None:
+            return
+        self.stale_rescorer.stop()
+        if self.embedding_indexer is not None:
+            self.embedding_indexer.stop()
+        _release(self.store, self.embeddings)
+
+    # ─── sentiment ─────────────────────────────────────────────────
+    def score_texts(self, texts):
+        # one record per forward pass (batch size, tokens) when metrics are on
+        with metrics.METRICS.inference(len(texts)) as record:
+            # long entries are scored window by window instead of being truncated
+            if self.long_text:
+                return classify_long(self.pipe, texts, stats=record)
+            if record is not None:
+                record["tokens"] = count_tokens(self.pipe, texts)
+            return classify_batch(self.pipe, texts, batch_size=len(texts))
+
+    def analyze_sentiment(self, text):
+        return self.sentiment_cache.get_or_compute(text, self.batcher.submit)
+
+    def analyze_many(self, texts):
+        """``analyze_sentiment`` for a list; cache misses go to the model together."""
+        results = [self.sentiment_cache.get(t) for t in texts]
+        misses = [i for i, r in enumerate(results) if r is None]
+        if misses:
+            t0 = time.perf_counter()
+            scored = self.batcher.submit_many([texts[i] for i in misses])
+            per_text = (time.perf_counter() - t0) / len(misses)
+            for i, (label, score) in zip(misses, scored):
+                self.sentiment_cache.put(texts[i], label, score, per_text)
+                results[i] = (label, score)
+        return results
+
+    def embed(self, texts):
+        return embed_texts(self.pipe, texts)
+
+    def similar_entries(self, eid, text, k=5):
+        """``[(entry, similarity), ...]`` of past entries most like ``text``, best first.
+
+        Only reads the stored vector of ``eid``; when it is missing or out of
+        date the entry goes to the background indexer and this returns None
+        (as it does while the model is loading), so no forward pass runs on
+        the caller's thread. Ask again on the next rerun.
+        """
+        if self.embeddings is None:
+            return None
+        vec = self.embeddings.vector(eid, text)
+        if vec is None:
+            self._queue_embedding(eid, text)
+            return None
+        hits = []
+        for other, sim in self.embeddings.top_k(vec, k, exclude=(eid,)):
+            entry = self.store.get_entry(other)
+            if entry is not None:
+                hits.append((entry, sim))
+        return hits
+
+    # ─── data ──────────────────────────────────────────────────────
+    def load_data(self):
+        return self.data_cache.get("frame", None, metrics.timed("load_frame", self.store.load_frame))
+
+    def save_entry(self, date, text, sentiment, score, emoji):
+        eid = self.store.upsert_entry(date, text, sentiment, score, emoji, self.model_version)
+        self.data_cache.invalidate()
+        return eid
+
+    def delete_entry(self, eid):
+        self.store.delete_entry(eid)
+        self.data_cache.invalidate()
+        if self.embeddings is not None:
+            self.embeddings.remove([eid])
+
+    def export_archive(self, start=None, end=None):
+        """Rewrite the archive months covering ``start``..``end`` from the store."""
+        return self.archive.export_store(self.store, start, end)
+
+    def _queue_embedding(self, eid, text):
+        if self.embedding_indexer is not None:
+            self.embedding_indexer.submit(eid, text)
+
+    def save_and_score(self, date, text):
+        """Save right away; score inline only on a cache hit, otherwise in the background.
+
+        Returns ``(id, (label, score))``, or ``(id, None)`` while scoring is pending.
+        """
+        hit = self.sentiment_cache.get(text, record_miss=False)
+        if hit is not None:
+            lab, sc = hit
+            eid = self.save_entry(date, text, lab, sc, EMOJI_MAP[lab])
+            self._queue_embedding(eid, text)
+            return eid, hit
+        eid = self.store.upsert_entry(date, text, PENDING, 0.0, PENDING_EMOJI)  # untagged until scored
+        self.data_cache.invalidate()
+        self.inference_queue.submit(eid, text)
+        self._queue_embedding(eid, text)
+        return eid, None
+
+    def save_many(self, entries, wait=False):
+        """Bulk create/update of ``(date, text)`` pairs in a single transaction.
+
+        With ``wait`` the texts are scored (batched) before saving; otherwise
+        they are stored pending and scored in the background.
+        """
+        entries = list(entries)
+        if wait:
+            results = self.analyze_many([text for _, text in entries])
+            ids = self.store.upsert_entries(
+                [(d, t, lab, sc, EMOJI_MAP[lab]) for (d, t), (lab, sc) in zip(entries, results)],
+                self.model_version,
+            )
+        else:
+            results = [None] * len(entries)
+            ids = self.store.upsert_entries([(d, t, PENDING, 0.0, PENDING_EMOJI) for d, t in entries])
+            for eid, (_, text) in zip(ids, entries):
+                self.inference_queue.submit(eid, text)
+        self.data_cache.invalidate()
+        for eid, (_, text) in zip(ids, entries):
+            self._queue_embedding(eid, text)
+        return list(zip(ids, results))
+
+
+def _release(store, embeddings):
+    if embeddings is not None:
+        embeddings.close()
+    store.close()
+
+
+_core = None
+_users = None
+_core_lock = threading.Lock()
+
+
+def get_core(**kwargs):
+    """The process-wide DiaryCore, created on first call.
+
+    In multi-user mode it holds only the shared model parts (no ``db_file``);
+    every diary lives in a user's shard.
+    """
+    global _core
+    if MULTI_USER:
+        kwargs.setdefault("db_file", None)
+    with _core_lock:
+        if _core is None:
+            _core = DiaryCore(**kwargs)
+        return _core
+
+
+def user_key(user):
+    """Directory-safe shard name for a user id (stable, no path characters)."""
+    return hashlib.sha256(str(user).encode("utf-8")).hexdigest()[:24]
+
+
+class UserCores:
+    """Per-user DiaryCores, one SQLite shard each, sharing ``base``'s model.
+
+    Every user's entries, search index, aggregates and embeddings live in
+    ``users_dir/<ab>/<key>/``, so saves only ever lock the writer's own file.
+    At most ``max_open`` cores stay open. Past that the least recently used
+    idle one is dropped from the registry, and its files are closed once no
+    session, request or job references the core any more; until then the
+    user's next request gets that same core back, so two cores never share
+    a shard's files.
+
+    Shards start no threads: one ``shard-maintenance`` thread walks the open
+    shards round-robin, re-scoring stale rows and embedding entries a batch
+    at a time, each round paced by ``run_duty_cycled``.
+    """
+
+    def __init__(self, base, users_dir=USERS_DIR, max_open=MAX_OPEN_USERS, archive_dir=ARCHIVE_DIR,
+                 rescore_stale=RESCORE_STALE, similar=SIMILAR_ENTRIES,
+                 interval=2.0, idle_interval=60.0, duty=3.0):
+        self.base = base
+        self.users_dir = users_dir
+        self.max_open = max_open
+        self.archive_dir = archive_dir
+        self.rescore_stale = rescore_stale
+        self.similar = similar
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.duty = duty
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._opening = {}
+        # dropped from _open but possibly still in use; entries vanish with the core
+        self._evicted = weakref.WeakValueDictionary()
+        self.opened = 0
+        self.evicted = 0
+        self.revived = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if rescore_stale or similar:
+            self._thread = threading.Thread(target=self._maintain, name="shard-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _round(self):
+        """One ``background_step`` for each open shard; -1 when none had work."""
+        with self._lock:
+            cores = list(self._open.values())
+        more, n = False, 0
+        for core in cores:
+            if self._stop.is_set() or self.base.busy():
+                return max(n, 0)  # come back after the pause
+            try:
+                m = core.background_step()
+            except Exception:
+                log.exception("shard maintenance step failed")
+                continue
+            more = more or m >= 0
+            n += max(m, 0)
+        return n if more else -1
+
+    def _maintain(self):
+        run_duty_cycled(
+            self._round, self._stop, busy=self.base.busy, wake=self._wake, interval=self.interval,
+            idle_interval=self.idle_interval, duty=self.duty, name="shard maintenance round",
+        )
+
+    def shard_dir(self, user):
+        key = user_key(user)
+        return os.path.join(self.users_dir, key[:2], key)
+
+    def get(self, user):
+        if not user:
+            raise ValueError("a user id is required in multi-user mode")
+        with self._lock:
+            core = self._open.get(user)
+            if core is not None:
+                self._open.move_to_end(user)
+                return core
+            # opening runs migrations; only the first caller per user does it
+            lock = self._opening.setdefault(user, threading.Lock())
+        with lock:
+            with self._lock:
+                core = self._open.get(user)
+                if core is not None:
+                    return core
+                core = self._evicted.pop(user, None)
+            if core is None:
+                core = self._create(user)
+                # closes the files when the last reference goes, not when the registry lets go
+                weakref.finalize(core, _release, core.store, core.embeddings)
+                revived = False
+            else:
+                revived = True
+            with self._lock:
+                self._open[user] = core
+                self._opening.pop(user, None)
+                if revived:
+                    self.revived += 1
+                else:
+                    self.opened += 1
+                # a reopened shard may have stale rows or a backfill to finish
+                self._wake.set()
+                self._evict()
+        return core
+
+    def _evict(self):
+        # shards with saves still being scored or embedded stay open past max_open
+        excess = len(self._open) - self.max_open
+        for user in [u for u, c in self._open.items() if c.idle()][:max(0, excess)]:
+            self._evicted[user] = self._open.pop(user)
+            self.evicted += 1
+
+    def _create(self, user):
+        path = self.shard_dir(user)
+        os.makedirs(path, exist_ok=True)
+        return DiaryCore(
+            db_file=os.path.join(path, DB_FILE),
+            csv_file=None,
+            embed_file=os.path.join(path, EMBED_FILE),
+            archive_dir=os.path.join(self.archive_dir, "users", user_key(user)) if self.archive_dir else None,
+            rescore_stale=self.rescore_stale,
+            similar=self.similar,
+            shared=self.base,
+            wake=self._wake,
+        )
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._open), "max_open": self.max_open, "opened": self.opened,
+                    "evicted": self.evicted, "revived": self.revived, "held": len(self._evicted)}
+
+
+def get_user_cores(**kwargs):
+    """The process-wide UserCores registry over the shared core."""
+    global _users
+    kwargs.setdefault("db_file", None)
+    base = get_core(**kwargs)
+    with _core_lock:
+        if _users is None:
+            _users = UserCores(base)
+        return _users
+
+
+def get_user_core(user, **kwargs):
+    """The DiaryCore of ``user``'s shard, sharing the process-wide model."""
+    return get_user_cores(**kwargs).get(user)
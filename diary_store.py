@@ -0,0 +1,561 @@
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date as _date
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ["id", "date", "text", "sentiment", "score", "emoji"]
+PENDING = "pending"
+PERIODS = ("day", "week", "month")
+AGG_VERSION = "1"
+SEARCH_VERSION = "1"
+# the trigram tokenizer indexes every 3-character substring, which suits Thai
+# (no spaces between words) without a word segmenter; shorter terms use LIKE
+TRIGRAM = 3
+# bm25 has to score every match; past this many, list newest first instead
+RANK_MAX_MATCHES = 2000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id        TEXT PRIMARY KEY,
+    date      TEXT NOT NULL,
+    text      TEXT NOT NULL DEFAULT '',
+    sentiment TEXT,
+    score     REAL NOT NULL DEFAULT 0.0,
+    emoji     TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entries_date ON entries (date);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS mood_agg (
+    period    TEXT NOT NULL,
+    bucket    TEXT NOT NULL,
+    sentiment TEXT NOT NULL,
+    emoji     TEXT NOT NULL,
+    n         INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    PRIMARY KEY (period, bucket, sentiment, emoji)
+) WITHOUT ROWID;
+"""
+
+# columns added after the first release; ALTERed into older databases on open
+ADDED_COLUMNS = {
+    "model_version": "TEXT",
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_entries_model_version ON entries (model_version);
+CREATE INDEX IF NOT EXISTS idx_entries_sentiment_date ON entries (sentiment, date);
+"""
+
+
+# external-content index over entries.text, keyed by entries.rowid
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    text, content='entries', content_rowid='rowid', tokenize='trigram'
+);
+"""
+
+
+def _iso(d):
+    return d.isoformat() if hasattr(d, "isoformat") else str(d)
+
+
+def bucket_keys(d):
+    """``{"day": "2024-01-03", "week": "2024-W01", "month": "2024-01"}`` for a date.
+
+    Keys sort lexicographically in time order, so bucket ranges are plain
+    string comparisons.
+    """
+    if not isinstance(d, _date):
+        d = _date.fromisoformat(str(d)[:10])
+    year, week, _ = d.isocalendar()
+    return {"day": d.isoformat(), "week": f"{year}-W{week:02d}", "month": f"{d.year}-{d.month:02d}"}
+
+
+def clean_csv_frame(df):
+    """Coerce a ``diary_records.csv`` frame: parsed dates, numeric scores, an id on every row."""
+    for col in COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    raw_dates = df["date"]
+    df["date"] = pd.to_datetime(raw_dates, errors="coerce").dt.date
+    bad = df["date"].isna()
+    if bad.any():
+        # the CSV itself is left in place, so these can be fixed by hand and re-imported
+        shown = ", ".join(f"line {i + 2}: {d!r}" for i, d in raw_dates[bad].head(10).items())
+        log.warning("skipped %d CSV row(s) with an unreadable date (%s%s)",
+                    int(bad.sum()), shown, ", ..." if bad.sum() > 10 else "")
+    df = df[~bad].copy()
+    df["score"] = pd.to_numeric(df["score"], errors="coerce").fillna(0.0)
+    df["id"] = df["id"].fillna("").astype(str) \
+        .apply(lambda x: str(uuid.uuid4()) if x == "" else x)
+    df["text"] = df["text"].fillna("").astype(str)
+    return df
+
+
+class DiaryStore:
+    """SQLite-backed diary storage (WAL mode, one row per save)."""
+
+    def __init__(self, path, csv_path=None):
+        self.path = path
+        self.csv_path = csv_path
+        self._local = threading.local()
+        self._conns_lock = threading.Lock()
+        self._conns = []
+        self._epoch = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        self._migrate_schema(conn)
+        self._migrate_csv()
+        self._migrate_aggregates()
+        self._migrate_search()
+
+    # ─── connection ────────────────────────────────────────────────
+    def _conn(self):
+        # sqlite3 connections must not cross threads; Streamlit runs each
+        # session in its own script thread, so keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.epoch != self._epoch:
+            # only ``close`` touches another thread's connection
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            with self._conns_lock:
+                self._conns.append(conn)
+                self._local.epoch = self._epoch
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close every thread's connection; a later call on any thread reopens its own."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._epoch += 1
+        for conn in conns:
+            conn.close()
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        changes = conn.total_changes
+        try:
+            yield conn
+            # a commit that changed rows bumps the generation, which readers use as a
+            # cache key; no-op writes (nothing to re-score, nothing to migrate) keep caches
+            if conn.total_changes != changes:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _get_meta(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # ─── migration ─────────────────────────────────────────────────
+    def _migrate_schema(self, conn):
+        have = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+        for name, decl in ADDED_COLUMNS.items():
+            if name not in have:
+                conn.execute(f"ALTER TABLE entries ADD COLUMN {name} {decl}")
+        conn.executescript(INDEXES)
+
+    def _migrate_csv(self):
+        if not self.csv_path:
+            return
+        with self._write() as conn:
+            if self._get_meta(conn, "csv_migrated"):
+                return
+            if os.path.exists(self.csv_path):
+                df = clean_csv_frame(pd.read_csv(self.csv_path))
+                rows = [
+                    (r.id, _iso(r.date), r.text, r.sentiment, float(r.score), r.emoji)
+                    for r in df[COLUMNS].itertuples(index=False)
+                ]
+                conn.executemany(
+                    "INSERT OR IGNORE INTO entries (id, date, text, sentiment, score, emoji) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_migrated', ?)",
+                (os.path.abspath(self.csv_path),),
+            )
+
+    def _migrate_aggregates(self):
+        with self._write() as conn:
+            if self._get_meta(conn, "agg_version") != AGG_VERSION:
+                self._rebuild_aggregates(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('agg_version', ?)",
+                    (AGG_VERSION,),
+                )
+
+    def _migrate_search(self):
+        conn = self._conn()
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+            self.fts = False
+            return
+        self.fts = True
+        with self._write() as conn:
+            if self._get_meta(conn, "search_version") != SEARCH_VERSION:
+                conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('search_version', ?)",
+                    (SEARCH_VERSION,),
+                )
+
+    # ─── search index ──────────────────────────────────────────────
+    # entries_fts is updated next to every text change in the same
+    # transaction, like mood_agg below; only the changed row is touched.
+    def _fts_apply(self, conn, rowid, text, sign):
+        if not self.fts:
+            return
+        if sign < 0:
+            conn.execute(
+                "INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', ?, ?)",
+                (rowid, text),
+            )
+        else:
+            conn.execute("INSERT INTO entries_fts (rowid, text) VALUES (?, ?)", (rowid, text))
+
+    # ─── aggregates ────────────────────────────────────────────────
+    # mood_agg holds per-day / ISO-week / month counts and score sums per
+    # (sentiment, emoji). Every write adjusts it in the same transaction, so
+    # the Stats tab never has to scan entries.
+    def _rebuild_aggregates(self, conn):
+        totals = defaultdict(lambda: [0, 0.0])
+        cur = conn.execute(
+            "SELECT date, sentiment, emoji, score FROM entries WHERE sentiment != ?", (PENDING,)
+        )
+        for d, sentiment, emoji, score in cur:
+            if sentiment is None:
+                continue
+            for period, bucket in bucket_keys(d).items():
+                t = totals[(period, bucket, sentiment, emoji or "")]
+                t[0] += 1
+                t[1] += score or 0.0
+        conn.execute("DELETE FROM mood_agg")
+        conn.executemany(
+            "INSERT INTO mood_agg (period, bucket, sentiment, emoji, n, score_sum) VALUES (?, ?, ?, ?, ?, ?)",
+            [(*k, n, sc) for k, (n, sc) in totals.items()],
+        )
+
+    def _agg_apply(self, conn, d, sentiment, emoji, score, sign):
+        if sentiment is None or sentiment == PENDING:
+            return
+        for period, bucket in bucket_keys(d).items():
+            conn.execute(
+                "INSERT INTO mood_agg (period, bucket, sentiment, emoji, n, score_sum) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, bucket, sentiment, emoji) "
+                "DO UPDATE SET n = n + excluded.n, score_sum = score_sum + excluded.score_sum",
+                (period, bucket, sentiment, emoji or "", sign, sign * float(score or 0.0)),
+            )
+            if sign < 0:
+                conn.execute(
+                    "DELETE FROM mood_agg WHERE period = ? AND bucket = ? AND sentiment = ? "
+                    "AND emoji = ? AND n <= 0",
+                    (period, bucket, sentiment, emoji or ""),
+                )
+
+    def aggregates(self, period, start=None, end=None):
+        """Aggregate rows for ``period`` whose bucket covers ``start``..``end`` (dates)."""
+        if period not in PERIODS:
+            raise ValueError(f"unknown period {period!r}, expected one of {PERIODS}")
+        clauses, params = ["period = ?"], [period]
+        if start is not None:
+            clauses.append("bucket >= ?")
+            params.append(bucket_keys(start)[period])
+        if end is not None:
+            clauses.append("bucket <= ?")
+            params.append(bucket_keys(end)[period])
+        return pd.read_sql_query(
+            "SELECT bucket, sentiment, emoji, n, score_sum FROM mood_agg "
+            f"WHERE {' AND '.join(clauses)} ORDER BY bucket",
+            self._conn(),
+            params=params,
+        )
+
+    # ─── API ───────────────────────────────────────────────────────
+    def version(self):
+        """Generation counter, incremented by every committed write from any process."""
+        return int(self._conn().execute(
+            "SELECT value FROM meta WHERE key = 'generation'"
+        ).fetchone()[0])
+
+    def _frame(self, sql, params=()):
+        df = pd.read_sql_query(sql, self._conn(), params=params)
+        df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
+        df["score"] = pd.to_numeric(df["score"], errors="coerce").fillna(0.0)
+        return df
+
+    def load_frame(self):
+        return self._frame("SELECT id, date, text, sentiment, score, emoji FROM entries ORDER BY rowid")
+
+    @staticmethod
+    def _filters(start=None, end=None, sentiments=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("date >= ?")
+            params.append(_iso(start))
+        if end is not None:
+            clauses.append("date <= ?")
+            params.append(_iso(end))
+        if sentiments:
+            clauses.append(f"sentiment IN ({', '.join('?' * len(sentiments))})")
+            params.extend(sentiments)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query_entries(self, start=None, end=None, sentiments=None, limit=20, offset=0):
+        """One page of entries, newest date first, with filters applied in SQL."""
+        where, params = self._filters(start, end, sentiments)
+        return self._frame(
+            "SELECT id, date, text, sentiment, score, emoji FROM entries"
+            f"{where} ORDER BY date DESC, rowid DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+
+    def count_entries(self, start=None, end=None, sentiments=None):
+        where, params = self._filters(start, end, sentiments)
+        return self._conn().execute(f"SELECT COUNT(*) FROM entries{where}", params).fetchone()[0]
+
+    def emoji_by_date(self, start, end):
+        """``{date: emoji}`` for ``start``..``end``; the latest row wins on duplicate dates."""
+        rows = self._conn().execute(
+            "SELECT date, emoji FROM entries WHERE date >= ? AND date <= ? ORDER BY rowid",
+            (_iso(start), _iso(end)),
+        ).fetchall()
+        return {_date.fromisoformat(d): e for d, e in rows}
+
+    @staticmethod
+    def _entry(row):
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        entry["date"] = pd.to_datetime(entry["date"]).date()
+        return entry
+
+    def get_entry(self, eid):
+        return self._entry(self._conn().execute(
+            "SELECT id, date, text, sentiment, score, emoji FROM entries WHERE id = ?", (eid,)
+        ).fetchone())
+
+    def entry_on(self, d):
+        """The entry saved for date ``d`` (the one ``upsert_entry`` updates), or None."""
+        return self._entry(self._conn().execute(
+            "SELECT id, date, text, sentiment, score, emoji FROM entries "
+            "WHERE date = ? ORDER BY rowid LIMIT 1",
+            (_iso(d),),
+        ).fetchone())
+
+    def _upsert(self, conn, date, text, sentiment, score, emoji, model_version):
+        row = conn.execute(
+            "SELECT rowid, id, text, sentiment, emoji, score FROM entries "
+            "WHERE date = ? ORDER BY rowid LIMIT 1",
+            (_iso(date),),
+        ).fetchone()
+        if row:
+            rowid, eid = row[:2]
+            self._agg_apply(conn, date, *row[3:], sign=-1)
+            if row[2] != text:
+                self._fts_apply(conn, rowid, row[2], sign=-1)
+                self._fts_apply(conn, rowid, text, sign=1)
+            conn.execute(
+                "UPDATE entries SET text = ?, sentiment = ?, score = ?, emoji = ?, "
+                "model_version = ? WHERE id = ?",
+                (text, sentiment, float(score), emoji, model_version, eid),
+            )
+        else:
+            eid = str(uuid.uuid4())
+            cur = conn.execute(
+                "INSERT INTO entries (id, date, text, sentiment, score, emoji, model_version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (eid, _iso(date), text, sentiment, float(score), emoji, model_version),
+            )
+            self._fts_apply(conn, cur.lastrowid, text, sign=1)
+        self._agg_apply(conn, date, sentiment, emoji, score, sign=1)
+        return eid
+
+    def upsert_entry(self, date, text, sentiment, score, emoji, model_version=None):
+        """Update the entry for ``date`` in place, or insert a new one. Returns its id."""
+        with self._write() as conn:
+            return self._upsert(conn, date, text, sentiment, score, emoji, model_version)
+
+    def upsert_entries(self, rows, model_version=None):
+        """``upsert_entry`` for many ``(date, text, sentiment, score, emoji)`` rows in one transaction."""
+        with self._write() as conn:
+            return [self._upsert(conn, *row, model_version) for row in rows]
+
+    def import_rows(self, rows):
+        """Insert or replace full entry dicts by id (archive import); returns how many were written.
+
+        Ids, dates and ``model_version`` are kept as given, so re-importing
+        an export is idempotent.
+        """
+        n = 0
+        with self._write() as conn:
+            for r in rows:
+                old = conn.execute(
+                    "SELECT date, sentiment, emoji, score, rowid, text FROM entries WHERE id = ?", (r["id"],)
+                ).fetchone()
+                if old is not None:
+                    self._agg_apply(conn, *old[:4], sign=-1)
+                    self._fts_apply(conn, *old[4:], sign=-1)
+                    conn.execute("DELETE FROM entries WHERE id = ?", (r["id"],))
+                cur = conn.execute(
+                    "INSERT INTO entries (id, date, text, sentiment, score, emoji, model_version) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (r["id"], _iso(r["date"]), r["text"] or "", r["sentiment"], float(r["score"] or 0.0),
+                     r["emoji"], r.get("model_version")),
+                )
+                self._fts_apply(conn, cur.lastrowid, r["text"] or "", sign=1)
+                self._agg_apply(conn, r["date"], r["sentiment"], r["emoji"], r["score"], sign=1)
+                n += 1
+        return n
+
+    def update_sentiment(self, eid, text, sentiment, score, emoji, model_version=None):
+        """Write back an inference result unless the text was edited meanwhile."""
+        return self.update_sentiments([(sentiment, score, emoji, eid, text)], model_version) > 0
+
+    def update_sentiments(self, rows, model_version=None):
+        """Bulk write-back of ``(sentiment, score, emoji, id, text)`` rows in one transaction."""
+        updated = 0
+        with self._write() as conn:
+            for sentiment, score, emoji, eid, text in rows:
+                old = conn.execute(
+                    "SELECT date, sentiment, emoji, score FROM entries WHERE id = ? AND text = ?",
+                    (eid, text),
+                ).fetchone()
+                if old is None:
+                    continue
+                self._agg_apply(conn, *old, sign=-1)
+                conn.execute(
+                    "UPDATE entries SET sentiment = ?, score = ?, emoji = ?, model_version = ? WHERE id = ?",
+                    (sentiment, float(score), emoji, model_version, eid),
+                )
+                self._agg_apply(conn, old[0], sentiment, emoji, score, sign=1)
+                updated += 1
+        return updated
+
+    def search(self, query, start=None, end=None, sentiments=None, limit=50):
+        """Entries containing every whitespace-separated term of ``query``, best match first.
+
+        Terms of three or more characters go through the trigram index and
+        are ranked by bm25 (newest first when they match too many entries to
+        rank cheaply); shorter ones are checked with LIKE on the matching rows
+        only. Returns the ``query_entries`` columns.
+        """
+        terms = [t for t in query.split() if t]
+        if not terms:
+            return self.query_entries(limit=0)
+        long_terms = [t for t in terms if len(t) >= TRIGRAM] if self.fts else []
+        short_terms = [t for t in terms if t not in long_terms]
+        where, params = self._filters(start, end, sentiments)
+        clauses = [where[len(" WHERE "):]] if where else []
+        for t in short_terms:
+            clauses.append("e.text LIKE ? ESCAPE '\\'")
+            params.append("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        cols = "e.id, e.date, e.text, e.sentiment, e.score, e.emoji"
+        if long_terms:
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            extra = "".join(f" AND {c}" for c in clauses)
+            n = self._conn().execute(
+                "SELECT COUNT(*) FROM entries_fts WHERE entries_fts MATCH ?", (match,)
+            ).fetchone()[0]
+            order = "entries_fts.rank, e.date DESC" if n <= RANK_MAX_MATCHES else "entries_fts.rowid DESC"
+            sql = (f"SELECT {cols} FROM entries_fts JOIN entries e ON e.rowid = entries_fts.rowid "
+                   f"WHERE entries_fts MATCH ?{extra} ORDER BY {order} LIMIT ?")
+            params = [match, *params]
+        else:
+            cond = " WHERE " + " AND ".join(clauses)
+            sql = f"SELECT {cols} FROM entries e{cond} ORDER BY e.date DESC, e.rowid DESC LIMIT ?"
+        return self._frame(sql, (*params, limit))
+
+    def iter_entries(self, chunk_size=1000, after_rowid=0):
+        """Yield lists of ``(rowid, id, text)`` in rowid order without loading the whole table."""
+        conn = self._conn()
+        while True:
+            chunk = conn.execute(
+                "SELECT rowid, id, text FROM entries WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (after_rowid, chunk_size),
+            ).fetchall()
+            if not chunk:
+                return
+            yield chunk
+            after_rowid = chunk[-1][0]
+
+    def iter_rows(self, start=None, end=None, chunk_size=1000):
+        """Yield full entry rows as dicts in rowid order, ``chunk_size`` at a time from SQLite."""
+        where, params = self._filters(start, end)
+        where = where.replace(" WHERE ", " AND ", 1)
+        conn = self._conn()
+        after_rowid = 0
+        while True:
+            chunk = conn.execute(
+                "SELECT rowid, id, date, text, sentiment, score, emoji, model_version FROM entries "
+                f"WHERE rowid > ?{where} ORDER BY rowid LIMIT ?",
+                (after_rowid, *params, chunk_size),
+            ).fetchall()
+            if not chunk:
+                return
+            for row in chunk:
+                yield dict(zip(COLUMNS + ["model_version"], row[1:]))
+            after_rowid = chunk[-1][0]
+
+    def count(self, after_rowid=0):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM entries WHERE rowid > ?", (after_rowid,)
+        ).fetchone()[0]
+
+    def stale_entries(self, model_version, limit=8, pending=PENDING):
+        """Rows whose ``model_version`` differs from the current one, oldest first.
+
+        Includes rows with no sentiment at all (e.g. imported from a CSV
+        without one); only ``pending`` rows are left to the inference queue.
+        """
+        return self._conn().execute(
+            "SELECT id, text FROM entries "
+            "WHERE (model_version IS NULL OR model_version != ?) AND (sentiment IS NULL OR sentiment != ?) "
+            "ORDER BY rowid LIMIT ?",
+            (model_version, pending, limit),
+        ).fetchall()
+
+    def count_stale(self, model_version, pending=PENDING):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM entries "
+            "WHERE (model_version IS NULL OR model_version != ?) AND (sentiment IS NULL OR sentiment != ?)",
+            (model_version, pending),
+        ).fetchone()[0]
+
+    def pending_entries(self, pending=PENDING):
+        return self._conn().execute(
+            "SELECT id, text FROM entries WHERE sentiment = ? ORDER BY rowid", (pending,)
+        ).fetchall()
+
+    def delete_entry(self, eid):
+        with self._write() as conn:
+            old = conn.execute(
+                "SELECT date, sentiment, emoji, score, rowid, text FROM entries WHERE id = ?", (eid,)
+            ).fetchone()
+            if old is not None:
+                self._agg_apply(conn, *old[:4], sign=-1)
+                self._fts_apply(conn, *old[4:], sign=-1)
+                conn.execute("DELETE FROM entries WHERE id = ?", (eid,))
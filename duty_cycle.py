@@ -0,0 +1,38 @@
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+def run_duty_cycled(step, stop, busy=None, wake=None, interval=2.0, idle_interval=60.0, duty=3.0,
+                    name="background step"):
+    """Call ``step()`` until ``stop`` is set, using at most ~1/(duty+1) of a core.
+
+    ``step`` returns how many rows it processed, 0 when it only scanned, or
+    a negative number when nothing is left to do. Nothing runs while
+    ``busy()`` is true (interactive saves come first). After a step that
+    processed rows the loop sleeps ``duty`` times as long as the step took,
+    and at least ``interval``; after a scan only the ``duty`` share. With
+    nothing left it sleeps ``idle_interval``. Setting ``wake`` cuts any of
+    those sleeps short; a step that raises is logged and treated as idle.
+    """
+    sleeper = wake or stop
+    while not stop.is_set():
+        if busy is not None and busy():
+            stop.wait(interval)
+            continue
+        t0 = time.perf_counter()
+        try:
+            n = step()
+        except Exception:
+            log.exception("%s failed", name)
+            n = -1
+        if n < 0:
+            pause = idle_interval
+        else:
+            pause = duty * (time.perf_counter() - t0)
+            if n:
+                pause = max(interval, pause)
+        sleeper.wait(pause)
+        if wake is not None:
+            wake.clear()
@@ -0,0 +1,424 @@
+"""Sentence-embedding index behind "Days like today".
+
+Vectors live in a memory-mapped ``.npy`` matrix, one row (slot) per entry;
+a small SQLite file next to it maps entry ids to slots and remembers a hash
+of the text each vector was computed from. Queries are a brute-force dot
+product over the mapped matrix, done in chunks:
+
+    python embedding_index.py bench --sizes 1000 10000 100000 [--dtype float16]
+
+float16 halves the file but each query has to widen it to float32 first,
+which costs several times the dot product itself on CPUs without fast
+half-precision conversion; float32 is the default.
+"""
+import argparse
+import hashlib
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from duty_cycle import run_duty_cycled
+from sentiment_cache import normalize_text
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    id        TEXT PRIMARY KEY,
+    slot      INTEGER NOT NULL UNIQUE,
+    text_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS free_slots (
+    slot INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+DTYPES = ("float32", "float16")
+MIN_CAPACITY = 1024
+# rows scored per step of a query; bounds the float32 copy of a float16 matrix
+QUERY_CHUNK = 32768
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingIndex:
+    """Memory-mapped matrix of unit vectors keyed by entry id.
+
+    ``model_key`` identifies the encoder; vectors from another encoder are
+    dropped on open. Safe to share between threads; other processes' writes
+    are picked up on the next read through SQLite's ``data_version``.
+    """
+
+    def __init__(self, path, model_key, dtype="float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"unknown embedding dtype {dtype!r}, expected one of {DTYPES}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.db_path = os.path.splitext(path)[0] + ".db"
+        self.model_key = model_key
+        self._lock = threading.RLock()
+        self._conn = None
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._mat = None
+        self._data_version = None
+        if self._meta("model") != model_key or self._meta("dtype") != dtype:
+            self._reset()
+        self._refresh()
+
+    # ─── bookkeeping ───────────────────────────────────────────────
+    @property
+    def _db(self):
+        # reopened on demand, so a reader racing ``close`` does not fail
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        """Close the SQLite connection and unmap the matrix."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._mat = None
+            self._data_version = None
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _reset(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute("DELETE FROM slots")
+        self._db.execute("DELETE FROM free_slots")
+        self._db.execute("DELETE FROM meta")
+        self._set_meta("model", self.model_key)
+        self._set_meta("dtype", self.dtype.name)
+        self._db.execute("COMMIT")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _refresh(self):
+        # data_version changes whenever another connection commits to the file
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version and self._mat is not None:
+            return
+        self._data_version = version
+        rows = self._db.execute("SELECT id, slot, text_hash FROM slots").fetchall()
+        self._slot = {eid: slot for eid, slot, _ in rows}
+        self._hash = {eid: h for eid, _, h in rows}
+        self._rows = int(self._meta("rows") or 0)
+        self._ids = np.empty(self._rows, dtype=object)
+        self._valid = np.zeros(self._rows, dtype=bool)
+        for eid, slot, _ in rows:
+            self._ids[slot] = eid
+            self._valid[slot] = True
+        if os.path.exists(self.path):
+            if self._mat is None or self._mat.shape[0] != int(self._meta("capacity") or 0):
+                self._mat = np.load(self.path, mmap_mode="r+")
+        else:
+            self._mat = None
+
+    def _ensure_capacity(self, rows, dim):
+        # callers hold the write lock (BEGIN IMMEDIATE), so no other process grows the file meanwhile
+        if self._mat is not None and self._mat.shape[0] >= rows:
+            return
+        capacity = max(MIN_CAPACITY, rows, 2 * (self._mat.shape[0] if self._mat is not None else 0))
+        tmp = self.path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(capacity, dim))
+        if self._mat is not None:
+            grown[: self._mat.shape[0]] = self._mat
+        grown.flush()
+        del grown
+        os.replace(tmp, self.path)
+        self._mat = np.load(self.path, mmap_mode="r+")
+        self._set_meta("capacity", capacity)
+
+    # ─── API ───────────────────────────────────────────────────────
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._slot)
+
+    def missing(self, rows):
+        """The ``(id, text)`` rows with no vector, or one computed from other text."""
+        with self._lock:
+            self._refresh()
+            return [(eid, text) for eid, text in rows if self._hash.get(eid) != text_hash(text)]
+
+    def vector(self, eid, text=None):
+        """Stored vector of ``eid`` (float32), or None; with ``text``, only if it is still current."""
+        with self._lock:
+            self._refresh()
+            slot = self._slot.get(eid)
+            if slot is None or (text is not None and self._hash[eid] != text_hash(text)):
+                return None
+            return np.asarray(self._mat[slot], dtype=np.float32)
+
+    def _track(self, rows_used):
+        if rows_used > len(self._ids):
+            grow = rows_used - len(self._ids)
+            self._ids = np.concatenate([self._ids, np.empty(grow, dtype=object)])
+            self._valid = np.concatenate([self._valid, np.zeros(grow, dtype=bool)])
+        self._rows = rows_used
+
+    def put(self, rows, vectors):
+        """Store one vector per ``(id, text)`` row, reusing the entry's slot if it has one."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            # refresh under the write lock: slots and the mapped file may have changed
+            # in another process right up to the moment we got it
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh()
+                rows_used = self._rows
+                slots = []
+                for eid, _ in rows:
+                    slot = self._slot.get(eid)
+                    if slot is None:
+                        free = self._db.execute("SELECT slot FROM free_slots LIMIT 1").fetchone()
+                        if free:
+                            slot = free[0]
+                            self._db.execute("DELETE FROM free_slots WHERE slot = ?", (slot,))
+                        else:
+                            slot = rows_used
+                            rows_used += 1
+                    slots.append(slot)
+                self._ensure_capacity(rows_used, vectors.shape[1])
+                self._mat[slots] = vectors.astype(self.dtype)
+                # vectors reach the file before the slots that point at them
+                self._mat.flush()
+                hashes = [text_hash(text) for _, text in rows]
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO slots (id, slot, text_hash) VALUES (?, ?, ?)",
+                    [(eid, slot, h) for (eid, _), slot, h in zip(rows, slots, hashes)],
+                )
+                self._set_meta("rows", rows_used)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                self._data_version = None
+                raise
+            # our own commits leave data_version alone, so mirror them in memory
+            self._track(rows_used)
+            for (eid, _), slot, h in zip(rows, slots, hashes):
+                self._slot[eid] = slot
+                self._hash[eid] = h
+                self._ids[slot] = eid
+                self._valid[slot] = True
+
+    def remove(self, ids):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh()
+                freed = []
+                for eid in ids:
+                    row = self._db.execute("SELECT slot FROM slots WHERE id = ?", (eid,)).fetchone()
+                    if row:
+                        self._db.execute("DELETE FROM slots WHERE id = ?", (eid,))
+                        self._db.execute("INSERT OR IGNORE INTO free_slots (slot) VALUES (?)", row)
+                        freed.append((eid, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                self._data_version = None
+                raise
+            for eid, slot in freed:
+                self._slot.pop(eid, None)
+                self._hash.pop(eid, None)
+                if slot < len(self._valid):
+                    self._valid[slot] = False
+
+    def ids(self):
+        with self._lock:
+            self._refresh()
+            return set(self._slot)
+
+    def top_k(self, vec, k=5, exclude=()):
+        """``[(id, cosine similarity), ...]`` of the ``k`` nearest stored vectors."""
+        with self._lock:
+            self._refresh()
+            if self._mat is None or not self._slot:
+                return []
+            n = self._rows
+            mat, ids, valid = self._mat, self._ids, self._valid.copy()
+        for eid in exclude:
+            slot = self._slot.get(eid)
+            if slot is not None and slot < n:
+                valid[slot] = False
+        q = np.asarray(vec, dtype=np.float32)
+        scores = np.empty(n, dtype=np.float32)
+        for i in range(0, n, QUERY_CHUNK):
+            scores[i:i + QUERY_CHUNK] = mat[i:min(n, i + QUERY_CHUNK)].astype(np.float32, copy=False) @ q
+        scores[~valid] = -np.inf
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top]
+
+
+class EmbeddingIndexer:
+    """Keeps an EmbeddingIndex in step with the store from a background thread.
+
+    Texts handed to ``submit`` (fresh saves and edits) are embedded first.
+    Otherwise it walks the store in chunks, embedding rows that are missing
+    or whose text changed and dropping vectors of deleted entries. A new
+    pass only starts once the store's generation has moved since the last
+    complete one. Paced by ``run_duty_cycled`` like the stale re-scorer.
+    ``wake`` is set on every ``submit``; pass a shared event when another
+    thread drives ``run_once`` instead of ``start``.
+    """
+
+    def __init__(self, store, index, embed, busy=None, batch_size=16,
+                 interval=2.0, idle_interval=300.0, chunk_size=512, duty=3.0, wake=None):
+        self.store = store
+        self.index = index
+        self.embed = embed
+        self.busy = busy or (lambda: False)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.chunk_size = chunk_size
+        self.duty = duty
+        self.embedded = 0
+        self._q = queue.Queue()
+        self._wake = wake or threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pass = None
+        self._pass_version = None
+        self._synced_version = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="embedding-indexer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def submit(self, eid, text):
+        self._q.put((eid, text))
+        self._wake.set()
+
+    def pending(self):
+        return self._q.qsize()
+
+    def _embed(self, rows):
+        rows = self.index.missing(rows)
+        for i in range(0, len(rows), self.batch_size):
+            batch = rows[i:i + self.batch_size]
+            self.index.put(batch, self.embed([text for _, text in batch]))
+            self.embedded += len(batch)
+        return len(rows)
+
+    def _backfill_chunks(self):
+        seen = set()
+        for chunk in self.store.iter_entries(self.chunk_size):
+            rows = [(eid, text) for _, eid, text in chunk]
+            seen.update(eid for eid, _ in rows)
+            yield rows
+        gone = self.index.ids() - seen
+        if gone:
+            self.index.remove(gone)
+
+    def run_once(self):
+        """Embed queued texts, else one backfill chunk; returns rows embedded or -1 when a pass ended."""
+        queued = []
+        while len(queued) < self.batch_size:
+            try:
+                queued.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        if queued:
+            return self._embed(queued)
+        if self._pass is None:
+            version = self.store.version()
+            if version == self._synced_version:
+                return -1  # nothing written since the last full pass
+            self._pass = self._backfill_chunks()
+            self._pass_version = version
+        try:
+            return self._embed(next(self._pass))
+        except StopIteration:
+            self._pass = None
+            self._synced_version = self._pass_version
+            return -1
+
+    def _step(self):
+        try:
+            n = self.run_once()
+        except Exception:
+            self._pass = None  # start the pass over rather than skip the failed chunk
+            raise
+        if not self._q.empty():
+            self._wake.set()  # queued saves go next, without the pause
+        return n
+
+    def _loop(self):
+        run_duty_cycled(
+            self._step, self._stop, busy=self.busy, wake=self._wake, interval=self.interval,
+            idle_interval=self.idle_interval, duty=self.duty, name="embedding batch",
+        )
+
+
+def bench(sizes, dim=768, k=5, dtype="float32", queries=50, path="bench_embeddings.npy"):
+    """Query latency of top_k on random unit vectors as the corpus grows."""
+    rng = np.random.default_rng(0)
+    print(f"{'entries':>10} {'p50 ms':>8} {'p99 ms':>8} {'matrix MB':>10}")
+    for n in sizes:
+        for f in (path, os.path.splitext(path)[0] + ".db"):
+            if os.path.exists(f):
+                os.remove(f)
+        index = EmbeddingIndex(path, f"bench-{dim}", dtype)
+        for i in range(0, n, 8192):
+            vecs = rng.standard_normal((min(8192, n - i), dim), dtype=np.float32)
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+            index.put([(f"e{j}", f"t{j}") for j in range(i, i + len(vecs))], vecs)
+        lat = []
+        for _ in range(queries):
+            q = rng.standard_normal(dim, dtype=np.float32)
+            t0 = time.perf_counter()
+            index.top_k(q / np.linalg.norm(q), k)
+            lat.append((time.perf_counter() - t0) * 1000)
+        lat.sort()
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{n:>10} {lat[len(lat) // 2]:>8.2f} {lat[min(len(lat) - 1, int(0.99 * len(lat)))]:>8.2f} "
+              f"{size_mb:>10.1f}")
+    for f in (path, os.path.splitext(path)[0] + ".db"):
+        if os.path.exists(f):
+            os.remove(f)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    bp = sub.add_parser("bench", help="top-k query latency on synthetic vectors")
+    bp.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    bp.add_argument("--dim", type=int, default=768)
+    bp.add_argument("--k", type=int, default=5)
+    bp.add_argument("--dtype", default="float32", choices=DTYPES)
+    args = ap.parse_args(argv)
+    bench(args.sizes, args.dim, args.k, args.dtype)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
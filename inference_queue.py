@@ -0,0 +1,71 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class InferenceQueue:
+    """Runs sentiment inference off the Streamlit script thread.
+
+    Entries are saved with a pending sentiment first; a worker then scores the
+    text and writes label, score and emoji back to the store by id.
+    """
+
+    def __init__(self, analyze, store, emoji_map, workers=1, model_version=None, pool=None):
+        self.analyze = analyze
+        self.store = store
+        self.emoji_map = emoji_map
+        self.model_version = model_version
+        # per-user queues share one pool (and its job count), so idle diarists cost no threads
+        self.pool = pool.pool if pool is not None else self
+        if pool is None:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sentiment")
+            self._pool_lock = threading.Lock()
+            self._pool_jobs = 0
+        else:
+            self.executor = self.pool.executor
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _count(self, delta):
+        with self.pool._pool_lock:
+            self.pool._pool_jobs += delta
+
+    def submit(self, eid, text):
+        with self._lock:
+            # a newer edit supersedes any job still queued for the same entry
+            self._inflight[eid] = text
+        self._count(1)
+        self.executor.submit(self._run, eid, text)
+
+    def _run(self, eid, text):
+        try:
+            with self._lock:
+                if self._inflight.get(eid) != text:
+                    return
+            label, score = self.analyze(text)
+            self.store.update_sentiment(
+                eid, text, label, score, self.emoji_map[label], self.model_version
+            )
+        except Exception:
+            log.exception("sentiment inference failed for entry %s", eid)
+        finally:
+            with self._lock:
+                if self._inflight.get(eid) == text:
+                    del self._inflight[eid]
+            self._count(-1)
+
+    def resume_pending(self):
+        """Re-enqueue rows left pending by a previous process."""
+        for eid, text in self.store.pending_entries():
+            self.submit(eid, text)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def pool_pending(self):
+        """Jobs queued or running on the shared pool, across every queue using it."""
+        with self.pool._pool_lock:
+            return self.pool._pool_jobs
@@ -0,0 +1,341 @@
+"""Concurrent-session load test of full streamlit_app.py reruns.
+
+    python loadtest.py --sessions 8 --actions 30
+    python loadtest.py --sessions 32 --actions 20 --model-ms 40 --multi-user --out run.json
+
+Each simulated session is a Streamlit ``AppTest`` driving the real script:
+saves, edits from the Summary tab and "tab switches" (Stats range, daily
+trend, Calendar view, Search), each of which is a full rerun. Every session
+gets its own block of dates (its own shard with ``--multi-user``), so a
+write that is missing or overwritten afterwards counts as a conflict.
+
+AppTest is not thread-safe (script compilation and its Runtime singleton
+race), so every session runs in its own spawned process, all on the same
+databases in a temporary directory - like several server workers behind a
+load balancer. The model is a stub that sleeps ``--model-ms`` per batch
+plus ``--text-ms`` per text, so load on the host comes from our code, not a
+real forward pass. Reports rerun latency percentiles per action, the error
+rate and write conflicts.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import Manager, get_context
+
+from check_backends import read_corpus
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thai_eval_corpus.txt")
+ACTION_MIX = {"save": 0.3, "edit": 0.15, "tab": 0.55}
+LABELS = ("negative", "neutral", "positive")
+SAVE_LABEL = "💾 บันทึกและวิเคราะห์"
+EDIT_LABEL = "ข้อความใหม่"
+# st.date_input only accepts dates within ten years of its value (today), and
+# today is the default entry date, so sessions write into the 9 years before it
+HISTORY_DAYS = 9 * 365
+
+
+class StubPipeline:
+    """Stands in for the transformers pipeline: fixed latency, label derived from the text."""
+
+    def __init__(self, batch_ms=20.0, text_ms=2.0):
+        self.batch_s = batch_ms / 1000.0
+        self.text_s = text_ms / 1000.0
+        self.calls = 0
+
+    def __call__(self, texts, batch_size=None, truncation=True, top_k=1):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self.calls += 1
+        time.sleep(self.batch_s + self.text_s * len(texts))
+        out = []
+        for t in texts:
+            h = int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)
+            out.append({"label": LABELS[h % 3], "score": 0.5 + (h % 500) / 1000.0})
+        return out
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    v = sorted(values)
+    pick = lambda q: round(v[min(len(v) - 1, int(q * len(v)))] * 1000, 1)  # noqa: E731
+    return {"n": len(v), "mean_ms": round(statistics.fmean(v) * 1000, 1),
+            "p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": round(v[-1] * 1000, 1)}
+
+
+class Session:
+    """One simulated user: an AppTest plus the writes it expects to find afterwards."""
+
+    def __init__(self, idx, corpus, args, stats):
+        from streamlit.testing.v1 import AppTest
+
+        self.idx = idx
+        self.rng = random.Random(args.seed * 1000 + idx)
+        self.corpus = corpus
+        self.args = args
+        self.stats = stats
+        # a block of dates per session, or the whole span when each has its own shard
+        self.days = HISTORY_DAYS if args.multi_user else max(1, HISTORY_DAYS // args.sessions)
+        self.first_day = date.today() - timedelta(days=HISTORY_DAYS) \
+            + timedelta(days=0 if args.multi_user else idx * self.days)
+        self.expected = {}
+        self.user = f"load-user-{idx}" if args.multi_user else None
+        self.at = AppTest.from_file(APP_FILE, default_timeout=args.timeout)
+
+    def _text(self):
+        return " ".join(self.rng.choice(self.corpus) for _ in range(self.rng.randint(1, 3))) \
+            + f" #{self.idx}-{self.rng.randrange(10 ** 6)}"
+
+    def _timed(self, action, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            if self.at.exception:
+                raise RuntimeError(self.at.exception[0].message)
+        except Exception as exc:
+            self.stats.error(action, exc)
+            return False
+        self.stats.rerun(action, time.perf_counter() - t0)
+        return True
+
+    def _button(self, label=None, key=None):
+        for b in self.at.button:
+            if (label is not None and b.label == label) or (key is not None and b.key == key):
+                return b
+        raise LookupError(f"no button {label or key!r} on the page")
+
+    def start(self):
+        def first():
+            self.at.run()
+            if self.user:
+                self.at.sidebar.text_input(key="diary_user").input(self.user).run()
+
+        self._timed("start", first)
+        self.save()  # the tabs only render once the diary has an entry
+        lo = self.first_day
+        self._timed("tab", lambda: self.at.date_input(key="summary_range")
+                    .set_value((lo, lo + timedelta(days=self.days - 1))).run())
+
+    def save(self):
+        day = self.first_day + timedelta(days=self.rng.randrange(self.days))
+        text = self._text()
+
+        def go():
+            # one rerun per widget change, as in a browser; the save callback
+            # reads the date rendered by the previous run
+            self.at.date_input(key="entry_date").set_value(day).run()
+            self.at.text_area(key="entry_text").input(text).run()
+            self._button(label=SAVE_LABEL).click().run()
+
+        if self._timed("save", go):
+            self.expected[day] = text
+
+    def edit(self):
+        rows = [b for b in self.at.button if (b.key or "").startswith("edit_")]
+        if not rows:
+            return self.save()
+        button = self.rng.choice(rows)
+        eid = button.key[len("edit_"):]
+        text = self._text()
+
+        def go():
+            button.click().run()
+            next(t for t in self.at.text_area if t.label == EDIT_LABEL).input(text).run()
+            self._button(key=f"save_{eid}").click().run()
+
+        day = self.stats.core_for(self.user).store.get_entry(eid)
+        if self._timed("edit", go) and day is not None:
+            self.expected[day["date"]] = text
+
+    def tab(self):
+        at, rng = self.at, self.rng
+        choice = rng.randrange(5)
+        if choice == 0:
+            fn = lambda: at.selectbox(key="stats_range").set_value(  # noqa: E731
+                rng.choice(["สัปดาห์นี้", "30 วันล่าสุด", "ไตรมาสนี้", "ปีนี้", "ทั้งหมด"])).run()
+        elif choice == 1:
+            fn = lambda: at.checkbox(key="stats_daily").set_value(rng.random() < 0.5).run()  # noqa: E731
+        elif choice == 2:
+            fn = lambda: at.radio(key="calendar_view").set_value(rng.choice(["รายเดือน", "ทั้งปี"])).run()  # noqa: E731
+        elif choice == 3:
+            fn = lambda: at.text_input(key="search_query").input(  # noqa: E731
+                rng.choice(self.corpus).split()[0]).run()
+        else:
+            fn = lambda: at.run()  # noqa: E731  (plain rerun, e.g. the pending refresh button)
+
+        def guarded():
+            try:
+                return fn()
+            except KeyError:
+                # widget not on the page this run (e.g. stats chart on an empty range)
+                return at.run()
+        self._timed("tab", guarded)
+
+    def run(self, barrier):
+        try:
+            self.start()
+        finally:
+            barrier.wait()
+        try:
+            for _ in range(self.args.actions):
+                action = self.rng.choices(list(ACTION_MIX), weights=list(ACTION_MIX.values()))[0]
+                getattr(self, action)()
+                if self.args.think_ms:
+                    time.sleep(self.rng.uniform(0, 2 * self.args.think_ms) / 1000.0)
+        finally:
+            barrier.wait()  # every session is done writing before anyone checks
+
+    def conflicts(self):
+        """Expected writes whose text is not what the entry for that date holds now."""
+        stored = self.stats.core_for(self.user).store.load_frame()
+        by_date = {str(d): texts for d, texts in stored.groupby("date")["text"].agg(list).items()}
+        return sum(by_date.get(str(day)) != [text] for day, text in self.expected.items())
+
+
+class Stats:
+    def __init__(self, core_for):
+        self.core_for = core_for
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.samples = []
+
+    def rerun(self, action, seconds):
+        self.latency[action].append(seconds)
+
+    def error(self, action, exc):
+        self.errors[action] += 1
+        if len(self.samples) < 5:
+            self.samples.append(f"{action}: {''.join(traceback.format_exception_only(exc)).strip()}")
+
+
+def wait_for_scoring(core, timeout):
+    deadline = time.monotonic() + timeout
+    while core.inference_queue.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_session(idx, args, workdir, barrier):
+    """Worker process: one core with the stub model, one session; returns its results."""
+    os.chdir(workdir)  # keeps the app's databases and startup timings out of the repo
+    os.environ["SOUNDINJAI_MULTI_USER"] = "1" if args.multi_user else "0"
+    # sessions sign in by typing their name; there is no auth provider under AppTest
+    os.environ["SOUNDINJAI_TRUST_USER_NAME"] = "1"
+    os.environ["SOUNDINJAI_STARTUP_REPORT"] = os.path.join(workdir, "startup_timings.jsonl")
+    # the stub has no encoder for similar entries; per-user shards read these defaults
+    os.environ["SOUNDINJAI_SIMILAR"] = "0"
+    os.environ["SOUNDINJAI_RESCORE_STALE"] = "0"
+    import diary_core
+
+    stub = StubPipeline(args.model_ms, args.text_ms)
+    # created before the first script run, so the app's get_core() returns this one
+    core = diary_core.get_core(
+        # with shards the shared core holds only the model
+        db_file=None if args.multi_user else os.path.join(workdir, "diary.db"), csv_file=None,
+        cache_file=os.path.join(workdir, "cache.db"), embed_file=os.path.join(workdir, "emb.npy"),
+        long_text=False, warmup=True, rescore_stale=False, similar=False, archive_dir=None,
+        loader=lambda model_name, backend: stub,
+    )
+
+    def core_for(user):
+        return diary_core.get_user_core(user) if user else core
+
+    stats = Stats(core_for)
+    session = Session(idx, read_corpus(CORPUS_FILE), args, stats)
+    session.run(barrier)
+    c = core_for(session.user)
+    wait_for_scoring(c, args.timeout)
+    return {
+        "latency": dict(stats.latency),
+        "errors": dict(stats.errors),
+        "samples": stats.samples,
+        "writes": len(session.expected),
+        "conflicts": session.conflicts(),
+        "model_batches": stub.calls,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=8)
+    ap.add_argument("--actions", type=int, default=30, help="actions per session after the first page")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's actions")
+    ap.add_argument("--model-ms", type=float, default=20.0, help="stub model cost per batch")
+    ap.add_argument("--text-ms", type=float, default=2.0, help="stub model cost per text")
+    ap.add_argument("--multi-user", action="store_true", help="one shard per session (SOUNDINJAI_MULTI_USER)")
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds one rerun may take")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write the report as JSON")
+    ap.add_argument("--keep-workdir", action="store_true", help="keep the sessions' databases and timings")
+    args = ap.parse_args(argv)
+
+    out = os.path.abspath(args.out) if args.out else None
+    workdir = tempfile.mkdtemp(prefix="soundinjai-load-")
+    latency, error_counts, samples = defaultdict(list), defaultdict(int), []
+    writes = conflicts = batches = 0
+    try:
+        with Manager() as manager:
+            barrier = manager.Barrier(args.sessions)
+            with ProcessPoolExecutor(args.sessions, mp_context=get_context("spawn")) as pool:
+                t0 = time.perf_counter()
+                futures = [pool.submit(run_session, i, args, workdir, barrier) for i in range(args.sessions)]
+                for f in futures:
+                    r = f.result()
+                    for action, values in r["latency"].items():
+                        latency[action].extend(values)
+                    for action, n in r["errors"].items():
+                        error_counts[action] += n
+                    samples.extend(r["samples"][:5 - len(samples)])
+                    writes += r["writes"]
+                    conflicts += r["conflicts"]
+                    batches += r["model_batches"]
+                wall = time.perf_counter() - t0
+    finally:
+        if args.keep_workdir:
+            print(f"work directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    reruns = sum(len(v) for v in latency.values())
+    errors = sum(error_counts.values())
+    report = {
+        "sessions": args.sessions,
+        "wall_s": round(wall, 2),
+        "reruns": reruns,
+        "reruns_per_s": round(reruns / wall, 2) if wall else None,
+        "error_rate": round(errors / max(1, reruns + errors), 4),
+        "errors": dict(error_counts),
+        "error_samples": samples,
+        "writes": writes,
+        "write_conflicts": conflicts,
+        "model_batches": batches,
+        "latency": {a: percentiles(v) for a, v in sorted(latency.items())},
+        "all": percentiles([x for v in latency.values() for x in v]),
+    }
+    print(f"{args.sessions} sessions, {reruns} reruns in {wall:.1f}s ({report['reruns_per_s']}/s), "
+          f"error rate {report['error_rate']:.2%}, {conflicts}/{writes} write conflicts, "
+          f"{batches} model batches")
+    print(f"{'action':<8} {'n':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for action, p in list(report["latency"].items()) + [("all", report["all"])]:
+        if p["n"]:
+            print(f"{action:<8} {p['n']:>6} {p['p50_ms']:>8} {p['p90_ms']:>8} {p['p99_ms']:>8} {p['max_ms']:>8}")
+    for line in samples:
+        print("  error", line)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+    return 1 if errors or conflicts else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""Hot-path timing spans, histograms and a Prometheus / JSON dump.
+
+Off unless SOUNDINJAI_METRICS=1; then ``span()`` hands back one shared
+no-op context manager, so instrumented code pays a function call and nothing
+else. When on, every span (load_entry, the model forward pass, Summary row
+rendering, figure builds, ...) feeds a fixed-bucket histogram, each script
+run and each model batch is kept as a record in a short ring buffer, and a
+daemon thread rewrites ``SOUNDINJAI_METRICS_FILE`` every few seconds:
+
+    SOUNDINJAI_METRICS=1 streamlit run streamlit_app.py
+    python metrics.py show [metrics.prom]
+
+A ``.json`` file name gets the JSON snapshot (histograms and the recent
+records); anything else gets Prometheus text exposition.
+"""
+import argparse
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("SOUNDINJAI_METRICS", "0") == "1"
+DUMP_FILE = os.environ.get("SOUNDINJAI_METRICS_FILE", "metrics.prom")
+DUMP_INTERVAL = float(os.environ.get("SOUNDINJAI_METRICS_INTERVAL", "15"))
+PREFIX = "soundinjai"
+# seconds; reruns and figure builds sit in the 10 ms .. 2 s range
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# batch sizes and token counts
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RECENT = 200
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense (``le`` upper bounds)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        """Rebuild from ``snapshot()`` output (e.g. a dump file) to re-estimate quantiles."""
+        hist = cls(float(le) for le in snap["buckets"] if le != "+Inf")
+        prev = 0
+        for i, n in enumerate(snap["buckets"].values()):
+            hist.counts[i], prev = n - prev, n
+        hist.count, hist.sum = snap["count"], snap["sum"]
+        return hist
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding rank ``q``."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def snapshot(self):
+        cumulative, total = [], 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "record", "t0")
+
+    def __init__(self, metrics, name, record=None):
+        self.metrics = metrics
+        self.name = name
+        self.record = record
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.metrics._span_done(self.name, time.perf_counter() - self.t0, self.record)
+        return False
+
+
+class Metrics:
+    """Process-wide collector; every method is cheap and thread-safe.
+
+    Histograms are keyed by family and a ``span`` label. Spans that end
+    while a script run is open on the same thread (``start_rerun`` ..
+    ``end_rerun``) are also summed into that run's record.
+    """
+
+    def __init__(self, enabled=ENABLED, recent=RECENT):
+        self.enabled = enabled
+        self.started = time.time()
+        self.reruns = deque(maxlen=recent)
+        self.inferences = deque(maxlen=recent)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._rerun = threading.local()
+        self._dumper = None
+
+    # ─── recording ─────────────────────────────────────────────────
+    def observe(self, family, value, buckets=TIME_BUCKETS, span=None):
+        key = (family, span)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def span(self, name):
+        """Time a phase: ``with metrics.span("load_entry"): ...``."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name, fn):
+        """``fn`` wrapped in ``span(name)``; ``fn`` itself when disabled (for cache compute callbacks)."""
+        if not self.enabled:
+            return fn
+
+        def run():
+            with _Span(self, name):
+                return fn()
+        return run
+
+    def inference(self, batch_size):
+        """Span around one model batch; yields its record so callers can add ``tokens``."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, "inference", {"batch_size": batch_size, "tokens": None})
+
+    def _span_done(self, name, seconds, record):
+        self.observe(f"{PREFIX}_span_seconds", seconds, span=name)
+        current = getattr(self._rerun, "record", None)
+        if current is not None:
+            current["spans"][name] = current["spans"].get(name, 0.0) + seconds
+        if record is not None:
+            record.update(ts=time.time(), seconds=seconds)
+            self.observe(f"{PREFIX}_inference_batch_size", record["batch_size"], SIZE_BUCKETS)
+            if record["tokens"] is not None:
+                self.observe(f"{PREFIX}_inference_tokens", record["tokens"], SIZE_BUCKETS)
+            with self._lock:
+                self.inferences.append(record)
+
+    def start_rerun(self):
+        if self.enabled:
+            # a run cut short by st.stop() never reaches end_rerun; the next start drops it
+            self._rerun.record = {"ts": time.time(), "t0": time.perf_counter(), "spans": {}}
+
+    def end_rerun(self, **fields):
+        record = getattr(self._rerun, "record", None)
+        if record is None:
+            return
+        self._rerun.record = None
+        seconds = time.perf_counter() - record.pop("t0")
+        record.update(seconds=seconds, **fields)
+        self.observe(f"{PREFIX}_rerun_seconds", seconds)
+        with self._lock:
+            self.reruns.append(record)
+
+    # ─── export ────────────────────────────────────────────────────
+    def histograms(self):
+        with self._lock:
+            return {key: hist.snapshot() for key, hist in sorted(self._histograms.items(),
+                                                                  key=lambda kv: (kv[0][0], kv[0][1] or ""))}
+
+    def snapshot(self):
+        with self._lock:
+            reruns, inferences = list(self.reruns), list(self.inferences)
+        return {
+            "started": self.started,
+            "ts": time.time(),
+            "histograms": [{"name": family, "span": span, **snap}
+                           for (family, span), snap in self.histograms().items()],
+            "reruns": reruns,
+            "inferences": inferences,
+        }
+
+    def prometheus_text(self):
+        lines, typed = [], set()
+        for (family, span), snap in self.histograms().items():
+            if family not in typed:
+                lines.append(f"# TYPE {family} histogram")
+                typed.add(family)
+            labels = f'span="{span}"' if span else ""
+            for le, n in snap["buckets"].items():
+                lines.append(f'{family}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {n}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{family}_sum{suffix} {snap['sum']:.6f}")
+            lines.append(f"{family}_count{suffix} {snap['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path=DUMP_FILE):
+        """Write the JSON snapshot (``*.json``) or Prometheus text, replacing ``path`` atomically."""
+        if path.endswith(".json"):
+            body = json.dumps(self.snapshot(), ensure_ascii=False, default=str)
+        else:
+            body = self.prometheus_text()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def start_dumper(self, path=DUMP_FILE, interval=DUMP_INTERVAL):
+        if not self.enabled or not path or self._dumper is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.dump(path)
+
+        self._dumper = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+        self._dumper.start()
+        atexit.register(self.dump, path)
+
+
+METRICS = Metrics()
+METRICS.start_dumper()
+span = METRICS.span
+timed = METRICS.timed
+
+
+def show(path):
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            hists = json.load(f)["histograms"]
+    else:
+        hists = _parse_prometheus(path)
+    print(f"{'metric':<44} {'count':>7} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9}")
+    for h in hists:
+        hist = Histogram.from_snapshot(h)
+        name = h["name"].removeprefix(f"{PREFIX}_") + (f"[{h['span']}]" if h["span"] else "")
+        fmt = (lambda v: f"{v * 1000:.1f}ms") if h["name"].endswith("_seconds") else (lambda v: f"{v:.0f}")
+        mean = h["sum"] / h["count"] if h["count"] else None
+        cells = [fmt(v) if v is not None else "-" for v in (mean, hist.quantile(0.5), hist.quantile(0.9),
+                                                            hist.quantile(0.99))]
+        print(f"{name:<44} {h['count']:>7} " + " ".join(f"{c:>9}" for c in cells))
+    return 0
+
+
+def _parse_prometheus(path):
+    hists = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            metric, value = line.rsplit(" ", 1)
+            name, _, labels = metric.partition("{")
+            pairs = dict(p.split("=", 1) for p in labels.rstrip("}").split(",") if p)
+            pairs = {k: v.strip('"') for k, v in pairs.items()}
+            for kind in ("_bucket", "_sum", "_count"):
+                if name.endswith(kind):
+                    family = name[: -len(kind)]
+                    break
+            h = hists.setdefault((family, pairs.get("span")),
+                                 {"name": family, "span": pairs.get("span"), "buckets": {}, "count": 0, "sum": 0.0})
+            if kind == "_bucket":
+                h["buckets"][pairs["le"]] = int(value)
+            elif kind == "_sum":
+                h["sum"] = float(value)
+            else:
+                h["count"] = int(value)
+    return list(hists.values())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("show", help="summarise a dump file")
+    sp.add_argument("file", nargs="?", default=DUMP_FILE)
+    args = ap.parse_args(argv)
+    return show(args.file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
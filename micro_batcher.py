@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+log = logging.getLogger(__name__)
+
+
+class BatcherOverloaded(RuntimeError):
+    pass
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-text requests into batched model calls.
+
+    One dispatcher thread owns the model. It takes the first queued request,
+    keeps collecting for up to ``max_wait_ms`` or ``max_batch`` items, runs
+    ``run_batch(texts)`` once and hands each caller its own result. The queue
+    is bounded: when it is full, ``submit`` blocks for ``submit_timeout``
+    seconds and then raises ``BatcherOverloaded``; so does a caller whose
+    result has not arrived within ``result_timeout`` (long enough for the
+    first call to load the model).
+    """
+
+    def __init__(self, run_batch, max_batch=16, max_wait_ms=5.0, max_queue=256,
+                 submit_timeout=30.0, result_timeout=300.0):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.submit_timeout = submit_timeout
+        self.result_timeout = result_timeout
+        self._q = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_depth = 0
+        self.batch_sizes = Counter()
+        self._latencies = deque(maxlen=2048)
+        threading.Thread(target=self._loop, name="micro-batcher", daemon=True).start()
+
+    def _enqueue(self, text):
+        fut = Future()
+        try:
+            self._q.put((text, fut, time.perf_counter()), timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise BatcherOverloaded(f"sentiment queue full ({self._q.maxsize} waiting)") from None
+        with self._lock:
+            self.max_depth = max(self.max_depth, self._q.qsize())
+        return fut
+
+    def _result(self, fut, deadline):
+        try:
+            return fut.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout:
+            with self._lock:
+                self.timed_out += 1
+            raise BatcherOverloaded(f"no sentiment result within {self.result_timeout:g}s") from None
+
+    def submit(self, text):
+        fut = self._enqueue(text)
+        return self._result(fut, time.perf_counter() + self.result_timeout)
+
+    def submit_many(self, texts):
+        """Queue all texts before waiting, so they share batches with each other."""
+        futures = [self._enqueue(text) for text in texts]
+        deadline = time.perf_counter() + self.result_timeout
+        return [self._result(fut, deadline) for fut in futures]
+
+    def _collect(self):
+        batch = [self._q.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = list(self.run_batch([text for text, _, _ in batch]))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} texts")
+            except Exception as exc:
+                log.exception("batched inference failed (%d items)", len(batch))
+                for _, fut, _ in batch:
+                    fut.set_exception(exc)
+                continue
+            now = time.perf_counter()
+            for (_, fut, t0), result in zip(batch, results):
+                fut.set_result(result)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self._latencies.extend(now - t0 for _, _, t0 in batch)
+
+    def stats(self):
+        def pct(q):
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else None
+
+        with self._lock:
+            lat = sorted(self._latencies)
+            return {
+                "queue_depth": self._q.qsize(),
+                "max_queue_depth": self.max_depth,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "latency_p50_ms": pct(0.5),
+                "latency_p99_ms": pct(0.99),
+            }
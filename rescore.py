@@ -0,0 +1,153 @@
+"""Re-score the whole diary offline, e.g. after changing model or backend.
+
+    python rescore.py --workers 4 --batch-size 32
+    python rescore.py --resume            # continue an interrupted run
+
+Records are streamed from the store in chunks, sorted into length buckets so
+each batch pads to similar lengths, scored in worker processes and written
+back one chunk per transaction. Progress is checkpointed after every chunk.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import get_context
+
+from diary_store import DiaryStore
+from sentiment_backends import (
+    BACKENDS, EMOJI_MAP, LONG_TEXT_VARIANT,
+    classify_batch, classify_long, load_pipeline, model_fingerprint,
+)
+
+# same defaults as the app (diary_core.py), so rows get the fingerprint it expects
+MODEL_NAME = os.environ.get("SOUNDINJAI_MODEL", "phoner45/wangchan-sentiment-thai-text-model")
+LONG_TEXT = os.environ.get("SOUNDINJAI_LONG_TEXT", "1") == "1"
+CHECKPOINT_FILE = "rescore.checkpoint.json"
+
+_pipe = None
+_batch_size = 16
+_long_text = False
+
+
+def _init_worker(model_name, backend, threads, batch_size, long_text=False):
+    global _pipe, _batch_size, _long_text
+    import torch
+
+    # several processes each using every core just thrash; cap per process
+    torch.set_num_threads(threads)
+    _pipe = load_pipeline(model_name, backend)
+    _batch_size = batch_size
+    _long_text = long_text
+
+
+def _score_chunk(chunk):
+    """Score one ``[(rowid, id, text), ...]`` chunk, shortest texts first."""
+    ordered = sorted(chunk, key=lambda r: len(r[2]))
+    results = []
+    for i in range(0, len(ordered), _batch_size):
+        bucket = ordered[i:i + _batch_size]
+        texts = [r[2] for r in bucket]
+        if _long_text:
+            scores = classify_long(_pipe, texts, batch_size=_batch_size)
+        else:
+            scores = classify_batch(_pipe, texts, _batch_size)
+        for (_, eid, text), (label, score) in zip(bucket, scores):
+            results.append((label, score, EMOJI_MAP[label], eid, text))
+    return chunk[-1][0], results
+
+
+def _scored_in_order(pool, chunks, depth):
+    # keep only a few chunks in flight so memory stays bounded on huge diaries
+    inflight = deque()
+    for chunk in chunks:
+        inflight.append(pool.apply_async(_score_chunk, (chunk,)))
+        if len(inflight) >= depth:
+            yield inflight.popleft().get()
+    while inflight:
+        yield inflight.popleft().get()
+
+
+def load_checkpoint(path, key):
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, encoding="utf-8") as f:
+        cp = json.load(f)
+    if cp.get("key") != key:
+        raise SystemExit(f"{path} belongs to a different run ({cp.get('key')}); remove it or drop --resume")
+    return cp["last_rowid"], cp["done"]
+
+
+def save_checkpoint(path, key, last_rowid, done):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "last_rowid": last_rowid, "done": done}, f)
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default="diary_records.db")
+    ap.add_argument("--csv", default="diary_records.csv", help="legacy CSV imported on first use")
+    ap.add_argument("--model", default=MODEL_NAME)
+    ap.add_argument("--backend", default=os.environ.get("SOUNDINJAI_BACKEND", "torch"), choices=BACKENDS)
+    ap.add_argument("--chunk-size", type=int, default=512)
+    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads", type=int, help="torch threads per worker (default: cores / workers)")
+    ap.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    ap.add_argument("--resume", action="store_true")
+    ap.add_argument("--no-long-text", dest="long_text", action="store_false", default=LONG_TEXT,
+                    help="truncate long entries instead of scoring them window by window")
+    args = ap.parse_args(argv)
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    # must match the app's fingerprint so rescored rows are not considered stale
+    version = model_fingerprint(
+        args.model, args.backend,
+        LONG_TEXT_VARIANT if args.long_text else "",
+    )
+    key = f"{os.path.abspath(args.db)}|{version}"
+    last_rowid, done = load_checkpoint(args.checkpoint, key) if args.resume else (0, 0)
+
+    store = DiaryStore(args.db, csv_path=args.csv)
+    total = done + store.count(last_rowid)
+    print(f"rescoring {total - done} of {total} entries with {args.model}@{args.backend} [{version}] "
+          f"({args.workers} worker(s) x {threads} thread(s))")
+
+    init_args = (args.model, args.backend, threads, args.batch_size, args.long_text)
+    chunks = store.iter_entries(args.chunk_size, after_rowid=last_rowid)
+    pool = None
+    if args.workers > 1:
+        pool = get_context("spawn").Pool(args.workers, initializer=_init_worker, initargs=init_args)
+        scored = _scored_in_order(pool, chunks, depth=2 * args.workers)
+    else:
+        _init_worker(*init_args)
+        scored = map(_score_chunk, chunks)
+
+    t0 = time.perf_counter()
+    started = done
+    try:
+        # results arrive in submission order, so last_rowid only ever moves forward
+        for last_rowid, rows in scored:
+            store.update_sentiments(rows, version)
+            done += len(rows)
+            save_checkpoint(args.checkpoint, key, last_rowid, done)
+            rate = (done - started) / (time.perf_counter() - t0)
+            print(f"\r{done}/{total} entries  {rate:.1f} records/s", end="", flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    print()
+
+    elapsed = time.perf_counter() - t0
+    print(f"done: {done - started} records in {elapsed:.1f}s "
+          f"({(done - started) / elapsed if elapsed else 0:.1f} records/s)")
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
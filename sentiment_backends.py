@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+
+BACKENDS = ("torch", "int8", "onnx")
+ONNX_DIR = os.environ.get("SOUNDINJAI_ONNX_DIR", "onnx_models")
+EMOJI_MAP = {"pos": "😊", "neu": "😐", "neg": "😢"}
+# bump whenever to_label() changes so stored rows get re-scored
+LABEL_MAPPING_VERSION = 1
+
+# long-entry mode: token windows per forward pass, overlap between neighbours,
+# and the most tokens one entry may cost regardless of its length
+WINDOW_TOKENS = 256
+OVERLAP_TOKENS = 32
+TOKEN_BUDGET = 1024
+LONG_TEXT_VARIANT = f"long-{WINDOW_TOKENS}-{OVERLAP_TOKENS}-{TOKEN_BUDGET}"
+
+
+def model_fingerprint(model_name, backend="torch", variant=""):
+    """Short id of everything that determines a stored (label, score)."""
+    key = f"{model_name}|{backend}|labels-v{LABEL_MAPPING_VERSION}|{variant}"
+    return f"{backend}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def to_label(raw_label):
+    label = raw_label.lower()
+    if label.startswith("pos"):
+        return "pos"
+    if label.startswith("neg"):
+        return "neg"
+    return "neu"
+
+
+def classify(pipe, text):
+    out = pipe(text)[0]
+    return to_label(out["label"]), out["score"]
+
+
+def classify_batch(pipe, texts, batch_size=16):
+    outs = pipe(list(texts), batch_size=batch_size, truncation=True)
+    return [(to_label(o["label"]), o["score"]) for o in outs]
+
+
+def count_tokens(pipe, texts):
+    """Tokens ``classify_batch`` feeds the model for ``texts``; None without a tokenizer."""
+    tokenizer = getattr(pipe, "tokenizer", None)
+    if tokenizer is None:
+        return None
+    return sum(len(ids) for ids in tokenizer(list(texts), truncation=True, verbose=False)["input_ids"])
+
+
+def split_windows(tokenizer, text, window=WINDOW_TOKENS, overlap=OVERLAP_TOKENS,
+                  budget=TOKEN_BUDGET):
+    """Cut ``text`` into overlapping token windows as ``[(piece, n_tokens), ...]``.
+
+    Pieces are sliced from the original string via the fast tokenizer's offsets.
+    When the entry needs more than ``budget`` tokens, windows are picked evenly
+    across it so beginning, middle and end all still count.
+    """
+    try:
+        enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = enc["offset_mapping"]
+        n = len(offsets)
+    except NotImplementedError:  # slow tokenizers have no offsets
+        tokens = tokenizer.tokenize(text)
+        offsets = None
+        n = len(tokens)
+    if n <= window:
+        return [(text, max(n, 1))]
+
+    step = window - overlap
+    starts = list(range(0, n - overlap, step))
+    max_windows = max(1, budget // window)
+    if len(starts) > max_windows:
+        if max_windows == 1:
+            picks = [0]
+        else:
+            picks = sorted({round(i * (len(starts) - 1) / (max_windows - 1)) for i in range(max_windows)})
+        starts = [starts[i] for i in picks]
+
+    windows = []
+    for start in starts:
+        end = min(start + window, n)
+        if offsets is not None:
+            piece = text[offsets[start][0]:offsets[end - 1][1]]
+        else:
+            piece = tokenizer.convert_tokens_to_string(tokens[start:end])
+        windows.append((piece, end - start))
+    return windows
+
+
+def classify_long(pipe, texts, window=WINDOW_TOKENS, overlap=OVERLAP_TOKENS,
+                  budget=TOKEN_BUDGET, batch_size=32, stats=None):
+    """Like ``classify_batch`` but scores every window of long entries.
+
+    All windows of all texts go through one batched pipeline call; each
+    entry's label distribution is the token-length-weighted mean over its
+    windows, and ``(label, score)`` is that distribution's argmax. A
+    ``stats`` dict gets the ``tokens`` and ``windows`` of the call.
+    """
+    pieces, owners, weights = [], [], []
+    for i, text in enumerate(texts):
+        for piece, n_tokens in split_windows(pipe.tokenizer, text, window, overlap, budget):
+            pieces.append(piece)
+            owners.append(i)
+            weights.append(n_tokens)
+    if stats is not None:
+        stats.update(tokens=sum(weights), windows=len(pieces))
+
+    outs = pipe(pieces, batch_size=min(batch_size, len(pieces)), truncation=True, top_k=None)
+    totals = [defaultdict(float) for _ in texts]
+    weight_sums = [0.0] * len(texts)
+    for owner, weight, out in zip(owners, weights, outs):
+        for o in out:
+            totals[owner][to_label(o["label"])] += weight * o["score"]
+        weight_sums[owner] += weight
+
+    results = []
+    for dist, wsum in zip(totals, weight_sums):
+        label = max(dist, key=dist.get)
+        results.append((label, dist[label] / wsum))
+    return results
+
+
+def embed_texts(pipe, texts, batch_size=32, max_tokens=WINDOW_TOKENS):
+    """Mean-pooled, L2-normalised sentence embeddings from the classifier's encoder.
+
+    Reuses the already loaded model (``model.base_model``) rather than a second
+    checkpoint. Entries are truncated to ``max_tokens``; returns float32 ``(n, dim)``.
+    """
+    import numpy as np
+    import torch
+
+    model = pipe.model
+    encoder = getattr(model, "base_model", None)
+    if encoder is None or not isinstance(model, torch.nn.Module):
+        raise RuntimeError("sentence embeddings need the 'torch' or 'int8' backend")
+    out = []
+    with torch.inference_mode():
+        for i in range(0, len(texts), batch_size):
+            enc = pipe.tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                                 max_length=max_tokens, return_tensors="pt")
+            hidden = encoder(**enc).last_hidden_state
+            mask = enc["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            vec = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+            out.append(torch.nn.functional.normalize(vec, dim=-1).float().numpy())
+    return np.concatenate(out)
+
+
+def _load_onnx(model_name, onnx_dir):
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as exc:
+        raise RuntimeError(
+            "the 'onnx' backend needs optimum and onnxruntime: "
+            "pip install 'optimum[onnxruntime]'"
+        ) from exc
+
+    export_dir = os.path.join(onnx_dir, model_name.replace("/", "__"))
+    if os.path.exists(os.path.join(export_dir, "model.onnx")):
+        return ORTModelForSequenceClassification.from_pretrained(export_dir)
+    # first use: export the PyTorch checkpoint once and reuse the graph afterwards
+    mdl = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+    mdl.save_pretrained(export_dir)
+    return mdl
+
+
+def load_pipeline(model_name, backend="torch", onnx_dir=ONNX_DIR):
+    """Build a text-classification pipeline for ``model_name`` on the given CPU backend.
+
+    ``torch`` is the fp32 baseline, ``int8`` applies dynamic int8 quantization to
+    the Linear layers and ``onnx`` runs an exported graph on ONNX Runtime.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown sentiment backend {backend!r}, expected one of {BACKENDS}")
+
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+
+    tok = AutoTokenizer.from_pretrained(model_name)
+    if backend == "onnx":
+        mdl = _load_onnx(model_name, onnx_dir)
+    else:
+        mdl = AutoModelForSequenceClassification.from_pretrained(model_name)
+        if backend == "int8":
+            import torch
+
+            mdl = torch.quantization.quantize_dynamic(mdl, {torch.nn.Linear}, dtype=torch.qint8)
+        mdl.eval()
+    return pipeline("text-classification", model=mdl, tokenizer=tok)
+
+
+class LazyPipeline:
+    """Defers importing transformers/torch and loading the model until first use.
+
+    Callable like the pipeline itself. ``warm_up()`` loads it on a daemon thread
+    so the first save does not pay for the load either. ``loader`` replaces
+    ``load_pipeline`` (e.g. a stub model in load tests).
+    """
+
+    def __init__(self, model_name, backend="torch", loader=None):
+        self.model_name = model_name
+        self.backend = backend
+        self.loader = loader or load_pipeline
+        self.load_seconds = None
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._pipe is not None
+
+    def get(self):
+        if self._pipe is None:
+            with self._lock:
+                if self._pipe is None:
+                    t0 = time.perf_counter()
+                    self._pipe = self.loader(self.model_name, self.backend)
+                    self.load_seconds = time.perf_counter() - t0
+        return self._pipe
+
+    def warm_up(self):
+        threading.Thread(target=self.get, name="sentiment-warmup", daemon=True).start()
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # tokenizer, model, ... of the underlying pipeline
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
@@ -0,0 +1,150 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sentiment_cache (
+    key       TEXT PRIMARY KEY,
+    label     TEXT NOT NULL,
+    score     REAL NOT NULL,
+    elapsed   REAL NOT NULL DEFAULT 0.0,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sentiment_cache_last_used ON sentiment_cache (last_used);
+"""
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text, model_name):
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class SentimentCache:
+    """Two-level (memory LRU + SQLite) cache of ``(label, score)`` results.
+
+    ``elapsed`` stores how long the original inference took, so every hit
+    can be credited with the CPU time it saved.
+    """
+
+    def __init__(self, path, model_name, max_memory=2048, max_disk=100_000):
+        self.path = path
+        self.model_name = model_name
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inserts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.inference_seconds = 0.0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_memory:
+                self._mem.popitem(last=False)
+
+    def get(self, text, record_miss=True):
+        key = cache_key(text, self.model_name)
+        with self._lock:
+            value = self._mem.get(key)
+            if value is not None:
+                self._mem.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_seconds += value[2]
+                return value[0], value[1]
+
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT label, score, elapsed FROM sentiment_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            if record_miss:
+                with self._lock:
+                    self.misses += 1
+            return None
+        conn.execute(
+            "UPDATE sentiment_cache SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self._remember(key, row)
+        with self._lock:
+            self.disk_hits += 1
+            self.saved_seconds += row[2]
+        return row[0], row[1]
+
+    def put(self, text, label, score, elapsed=0.0):
+        key = cache_key(text, self.model_name)
+        value = (label, float(score), float(elapsed))
+        self._remember(key, value)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sentiment_cache (key, label, score, elapsed, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, *value, time.time()),
+        )
+        with self._lock:
+            self._inserts += 1
+            evict = self._inserts % 256 == 0
+        if evict:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        (count,) = conn.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()
+        overflow = count - self.max_disk
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM sentiment_cache WHERE key IN "
+                "(SELECT key FROM sentiment_cache ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+
+    def get_or_compute(self, text, compute):
+        hit = self.get(text)
+        if hit is not None:
+            return hit
+        t0 = time.perf_counter()
+        label, score = compute(text)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.inference_seconds += elapsed
+        self.put(text, label, score, elapsed)
+        return label, score
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_entries": len(self._mem),
+                "saved_seconds": round(self.saved_seconds, 3),
+                "inference_seconds": round(self.inference_seconds, 3),
+            }
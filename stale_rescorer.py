@@ -0,0 +1,54 @@
+import threading
+
+from duty_cycle import run_duty_cycled
+
+
+class StaleRescorer:
+    """Low-priority background job that re-scores rows tagged with an old model version.
+
+    Works in small batches, paced by ``run_duty_cycled``.
+    """
+
+    def __init__(self, store, score_batch, emoji_map, model_version, busy=None,
+                 batch_size=8, interval=2.0, idle_interval=60.0, duty=3.0):
+        self.store = store
+        self.score_batch = score_batch
+        self.emoji_map = emoji_map
+        self.model_version = model_version
+        self.busy = busy or (lambda: False)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.duty = duty
+        self.rescored = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="stale-rescorer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """Re-score one batch; returns how many rows were stale."""
+        rows = self.store.stale_entries(self.model_version, limit=self.batch_size)
+        if not rows:
+            return 0
+        results = self.score_batch([text for _, text in rows])
+        self.store.update_sentiments(
+            [(lab, sc, self.emoji_map[lab], eid, text)
+             for (eid, text), (lab, sc) in zip(rows, results)],
+            self.model_version,
+        )
+        self.rescored += len(rows)
+        return len(rows)
+
+    def _loop(self):
+        run_duty_cycled(
+            lambda: self.run_once() or -1, self._stop, busy=self.busy, interval=self.interval,
+            idle_interval=self.idle_interval, duty=self.duty, name="stale re-scoring batch",
+        )
@@ -0,0 +1,139 @@
+"""Cold-start timing for the Streamlit app.
+
+streamlit_app.py appends one JSON line per process to startup_timings.jsonl
+on its first completed run. Summarise those, or measure cold import cost of
+the heavy dependencies and of the app's whole import chain in fresh
+interpreters:
+
+    python startup_timing.py report [--budget 3.0]
+    python startup_timing.py imports [--budget 2.0]
+
+The in-app ``script_imports_s`` is warm: the Streamlit server process has
+already imported streamlit and pandas before the script runs, so only
+``imports`` shows what a cold start pays for imports.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+REPORT_FILE = os.environ.get("SOUNDINJAI_STARTUP_REPORT", "startup_timings.jsonl")
+HEAVY_MODULES = ["streamlit", "pandas", "plotly.express", "transformers", "torch"]
+# what streamlit_app.py imports before its first paint
+APP_IMPORTS = ["streamlit", "pandas", "metrics", "diary_core", "trend_figures", "year_heatmap"]
+
+_lock = threading.Lock()
+_reported = False
+
+
+def record_first_paint(script_imports_s, paint_s, torch_imported, **extra):
+    """Append the timing of the first run in this process; later calls are no-ops.
+
+    ``torch_imported`` should be taken right after the script's imports,
+    before the model warm-up thread can import torch itself.
+    """
+    global _reported
+    with _lock:
+        if _reported:
+            return
+        _reported = True
+    row = {
+        "ts": time.time(),
+        "pid": os.getpid(),
+        "script_imports_s": round(script_imports_s, 4),
+        "first_paint_s": round(paint_s, 4),
+        "torch_imported": torch_imported,
+        **extra,
+    }
+    try:
+        with open(REPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n")
+    except OSError:
+        pass
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(path, budget=None):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    if not rows:
+        print("no startup timings recorded yet")
+        return 0
+    print(f"{len(rows)} cold starts")
+    for key, label in (("script_imports_s", "script imports (warm)"), ("first_paint_s", "first paint")):
+        vals = [r[key] for r in rows]
+        print(f"{label:<22} p50={statistics.median(vals):.3f}s p90={_pct(vals, 0.9):.3f}s "
+              f"last={vals[-1]:.3f}s")
+    eager = sum(r.get("torch_imported", False) for r in rows[-10:])
+    if eager:
+        print(f"warning: the script's imports pulled in torch in {eager} of the last runs")
+    print("cold import cost: python startup_timing.py imports")
+    if budget is not None and rows[-1]["first_paint_s"] > budget:
+        print(f"FAIL: last first paint {rows[-1]['first_paint_s']:.3f}s > budget {budget:.3f}s")
+        return 1
+    return 0
+
+
+def cold_import_seconds(module):
+    # -X importtime prints "import time: self | cumulative | name" to stderr
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return None
+    top = module.split(".")[0]
+    for line in reversed(proc.stderr.splitlines()):
+        m = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)$", line)
+        if m and m.group(2) in (module, top):
+            return int(m.group(1)) / 1e6
+    return None
+
+
+def cold_app_import_seconds(modules=APP_IMPORTS):
+    """Wall time of importing ``modules`` together in a fresh interpreter."""
+    code = ("import importlib, time; t0 = time.perf_counter()\n"
+            f"for m in {list(modules)!r}: importlib.import_module(m)\n"
+            "print(time.perf_counter() - t0)")
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        return None
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("report")
+    rp.add_argument("--file", default=REPORT_FILE)
+    rp.add_argument("--budget", type=float, help="fail if the last first paint took longer (s)")
+    ip = sub.add_parser("imports")
+    ip.add_argument("modules", nargs="*", default=HEAVY_MODULES)
+    ip.add_argument("--budget", type=float, help="fail if the app's cold import chain takes longer (s)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "report":
+        return report(args.file, args.budget)
+    for module in args.modules:
+        secs = cold_import_seconds(module)
+        print(f"{module:<16} {'not installed' if secs is None else f'{secs:.3f}s'}")
+    app = cold_app_import_seconds()
+    print(f"{'app (cold)':<16} {'failed' if app is None else f'{app:.3f}s'}")
+    if args.budget is not None and (app is None or app > args.budget):
+        print(f"FAIL: cold app imports {'failed' if app is None else f'{app:.3f}s'} > budget {args.budget:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,37 @@
+import sys
+import time
+_script_t0 = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
 import calendar
-from datetime import datetime, timedelta
-import os
-import uuid
-import random
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+from datetime import date, datetime, timedelta
+import startup_timing
+from metrics import METRICS
+from diary_core import (
+    MULTI_USER, PENDING_EMOJI, TRUST_USER_NAME, get_core, get_user_core, get_user_cores, suggest_message,
+)
+from diary_store import PENDING
+from sentiment_backends import EMOJI_MAP
+from trend_figures import (
+    MOOD_LEVEL_MAP, ROLLING_DAYS,
+    bucket_trend_figure, daily_mood, daily_trend_figure, emoji_bar_figure, sentiment_pie_figure,
+)
+from year_heatmap import day_index, heatmap_figure, year_span
+# warm figure: the server process already imported streamlit/pandas (see startup_timing.py)
+_script_imports_s = time.perf_counter() - _script_t0
+# taken before get_core() can start the warm-up thread, which imports torch on its own
+_torch_at_import = "torch" in sys.modules
 
 
 # ─── CONFIG ─────────────────────────────────────────────────────────
 st.set_page_config(page_title="เสียงในใจ — Diary", layout="wide")
-DATA_FILE = "diary_records.csv"
-EMOJI_MAP = {"pos": "😊", "neu": "😐", "neg": "😢"}
+PAGE_SIZES = [10, 20, 50, 100]
+SEARCH_LIMIT = 50
+SIMILAR_K = 3
+HEATMAP_YEARS = [1, 2, 3, 5]
+STATS_RANGES = ["สัปดาห์นี้", "30 วันล่าสุด", "ไตรมาสนี้", "ปีนี้", "ทั้งหมด", "กำหนดเอง"]
+SENTIMENT_SCORE_MAP = {"pos": 1.0, "neu": 0.5, "neg": 0.0}
 
 st.markdown("""
     <style>
@@ -57,88 +77,111 @@ st.markdown("""
 
 
 
-# ─── MODEL ──────────────────────────────────────────────────────────
+# ─── CORE ───────────────────────────────────────────────────────────
 @st.cache_resource
-def load_pipe():
-    model_name = "phoner45/wangchan-sentiment-thai-text-model"
-    tok = AutoTokenizer.from_pretrained(model_name)
-    mdl = AutoModelForSequenceClassification.from_pretrained(model_name)
-    return pipeline("text-classification", model=mdl, tokenizer=tok)
-
-sentiment_pipe = load_pipe()
+def get_diary_core():
+    # one engine per process, shared by every session (see diary_core.py)
+    return get_core()
+
+def auth_configured():
+    try:
+        return "auth" in st.secrets
+    except Exception:
+        return False
+
+def current_user():
+    """Signed-in account; the name typed in the sidebar only with SOUNDINJAI_TRUST_USER_NAME=1.
+
+    Stops the script (with a sign-in button when auth is configured) until
+    there is a user, so a shard is never picked from an unauthenticated name
+    unless the operator opted into that.
+    """
+    user = getattr(st, "user", None)
+    if user is not None and getattr(user, "is_logged_in", False):
+        return user.email
+    if TRUST_USER_NAME:
+        name = st.sidebar.text_input("👤 ผู้ใช้", key="diary_user").strip()
+        if not name:
+            st.info("กรุณาใส่ชื่อผู้ใช้ที่แถบด้านข้างก่อนเริ่มบันทึก")
+            st.stop()
+        return name
+    if auth_configured():
+        st.info("กรุณาเข้าสู่ระบบก่อนเริ่มบันทึก")
+        st.button("เข้าสู่ระบบ", on_click=st.login)
+    else:
+        st.error("Multi-user mode needs Streamlit sign-in ([auth] in .streamlit/secrets.toml), "
+                 "or SOUNDINJAI_TRUST_USER_NAME=1 on a trusted network.")
+    st.stop()
+
+core = get_diary_core()
+if MULTI_USER:
+    # each user reads and writes only their own shard; the model stays shared
+    core = get_user_core(current_user())
+store = core.store
+data_cache = core.data_cache
+sentiment_pipe = core.pipe
+sentiment_cache = core.sentiment_cache
+batcher = core.batcher
+stale_rescorer = core.stale_rescorer
+MODEL_VERSION = core.model_version
+data_cache.start_rerun()
+METRICS.start_rerun()
 
 def analyze_sentiment(text: str):
-    out = sentiment_pipe(text)[0]
-    label = out["label"].lower()
-    if label.startswith("pos"):
-        label = "pos"
-    elif label.startswith("neg"):
-        label = "neg"
-    else:
-        label = "neu"
-    return label, out["score"]
-
-def suggest_message(sentiment, score):
-    suggestions = {
-        "pos": [
-            "วันนี้คุณดูสดใสมาก! 🌟 ลองแบ่งปันรอยยิ้มให้คนรอบข้างดูสิ",
-            "รักษาความรู้สึกดี ๆ แบบนี้ไว้นาน ๆ นะ 😊",
-            "เยี่ยมเลย! เก็บโมเมนต์ดี ๆ ไว้ในใจ ❤️"
-        ],
-        "neu": [
-            "วันกลาง ๆ ก็โอเคนะ ลองทำสิ่งใหม่ ๆ ดูไหม?",
-            "ลองเขียนหาอะไรทำดูสิ เช่นเล่นเกม ดูหนัง อาจทำให้รู้สึกดีขึ้น",
-            "อารมณ์นิ่ง ๆ แบบนี้ ลองฟังเพลงชิล ๆ ก็ไม่เลวนะ"
-        ],
-        "neg": [
-            "คุณเก่งมาก วันนี้พยายามได้ดีมากได้เวลาพักผ่อนนน อย่าลืมฟังเพลงโปรดก่อนนอนละ",
-            "ส่งกำลังใจให้คุณผ่านวันนี้ไปได้ ✨",
-            "อย่าลืมหายใจลึก ๆ แล้วค่อย ๆ ก้าวต่อไปนะ 💛"
-        ]
-    }
-    return random.choice(suggestions[sentiment])
-
-# ─── DATA ──────────────────────────────────────────────────────────
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        pd.DataFrame(columns=["id", "date", "text", "sentiment", "score", "emoji"]) \
-            .to_csv(DATA_FILE, index=False)
-
-    df = pd.read_csv(DATA_FILE)
-    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
-    df["score"] = pd.to_numeric(df["score"], errors="coerce").fillna(0.0)
-    if "id" not in df.columns:
-        df["id"] = [str(uuid.uuid4()) for _ in range(len(df))]
-    else:
-        df["id"] = df["id"].fillna("").apply(lambda x: str(uuid.uuid4()) if x == "" else x)
-    return df
+    return core.analyze_sentiment(text)
 
 def save_entry(date, text, sentiment, score, emoji):
-    df = load_data()
-    mask = df["date"] == date
-    if mask.any():
-        idx = df[mask].index[0]
-        df.loc[idx, ["text", "sentiment", "score", "emoji"]] = [text, sentiment, score, emoji]
-    else:
-        df.loc[len(df)] = {
-            "id": str(uuid.uuid4()),
-            "date": date,
-            "text": text,
-            "sentiment": sentiment,
-            "score": score,
-            "emoji": emoji
-        }
-    df.to_csv(DATA_FILE, index=False)
+    core.save_entry(date, text, sentiment, score, emoji)
 
 def delete_entry(eid):
-    df = load_data()
-    df = df[df["id"] != eid]
-    df.to_csv(DATA_FILE, index=False)
+    core.delete_entry(eid)
+
+def save_and_score(date, text):
+    """Save right away; score inline only on a cache hit, otherwise in the background."""
+    eid, result = core.save_and_score(date, text)
+    st.session_state.similar_to = (eid, text)
+    return result
 
 if st.query_params.get("scroll") == "edit":
     st.write('<script>window.scrollTo(0, document.body.scrollHeight);</script>', unsafe_allow_html=True)
     st.query_params.clear()  # reset query params
 
+def stats_range(choice, today, picked=()):
+    """(start, end, trend period) for a Stats range choice."""
+    if choice == "สัปดาห์นี้":
+        return today - timedelta(days=today.weekday()), today, "day"
+    if choice == "30 วันล่าสุด":
+        return today - timedelta(days=29), today, "day"
+    if choice == "ไตรมาสนี้":
+        return date(today.year, 3 * ((today.month - 1) // 3) + 1, 1), today, "week"
+    if choice == "ปีนี้":
+        return date(today.year, 1, 1), today, "month"
+    if choice == "ทั้งหมด":
+        return None, today, "month"
+    start = picked[0] if len(picked) > 0 else today
+    end = picked[1] if len(picked) > 1 else start
+    span = (end - start).days
+    return start, end, "day" if span <= 45 else "week" if span <= 200 else "month"
+
+def mood_trend(period, start, end):
+    """Mean mood level per ``period`` bucket, from the maintained aggregates."""
+    agg = history_cache.get("agg", (period, start, end), lambda: history.aggregates(period, start, end))
+    agg = agg.assign(level_sum=agg["n"] * agg["sentiment"].map(MOOD_LEVEL_MAP))
+    trend = agg.groupby("bucket")[["level_sum", "n"]].sum().reset_index()
+    trend["mood_level"] = trend["level_sum"] / trend["n"]
+    trend["label"] = trend["bucket"].map(lambda b: bucket_label(period, b))
+    return trend
+
+def bucket_label(period, bucket):
+    if period == "day":
+        return date.fromisoformat(bucket).strftime("%a %d %b")
+    if period == "month":
+        return datetime.strptime(bucket, "%Y-%m").strftime("%b %Y")
+    return bucket
+
+def reset_summary_page():
+    st.session_state.summary_page = 1
+
 def toggle_edit(rid):
     if st.session_state.get("edit_id") == rid:
         st.session_state.edit_id = None
@@ -149,8 +192,6 @@ def toggle_edit(rid):
 # ─── UI ─────────────────────────────────────────────────────────────
 
 import calendar
-import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 from datetime import date, datetime, timedelta
 import streamlit as st
@@ -252,6 +293,9 @@ st.markdown("""
     .stTabs [role="tablist"] > button:nth-child(3) {
         background-color: #fff3b0 !important; /* สีเหลืองอ่อน */
     }
+    .stTabs [role="tablist"] > button:nth-child(4) {
+        background-color: #ffd6c9 !important; /* สีพีช */
+    }
             
     .summary-title {
         font-size: 35px;
@@ -363,13 +407,20 @@ st.markdown("""
         color: #F44336 !important; /* แดง */
         font-weight: bold;
         font-size: 18px;
+    }
+
+    .pending-score, .sentiment-pending {
+        color: #9E9E9E !important; /* เทา */
+        font-weight: bold;
+        font-size: 18px;
     }            
 
 </style>
 """, unsafe_allow_html=True)
 
-# Load data
-df = load_data()
+# only a row count here and the selected day's entry below, never the whole table
+with METRICS.span("load_entry"):
+    n_entries = data_cache.get("count", (None, None, None), store.count_entries)
 if "entry_date" not in st.session_state:
     st.session_state.entry_date = datetime.now().date()
 if "entry_text" not in st.session_state:
@@ -383,17 +434,20 @@ entry_date = st.date_input(
     value=st.session_state.get("entry_date", datetime.now().date()),
     key="entry_date"
 )
-existing = df[df["date"] == entry_date]
-default_text = existing.iloc[0]["text"] if not existing.empty else ""
+with METRICS.span("load_entry"):
+    existing = data_cache.get("entry_on", entry_date, lambda: store.entry_on(entry_date))
+default_text = existing["text"] if existing is not None else ""
 entry_text = st.text_area("🌷 บันทึกความรู้สึกประจำวัน", value=st.session_state.get("entry_text", default_text), height=200, key="entry_text")
 
 def on_new_save():
     if st.session_state.entry_text.strip():
-        lab, sc = analyze_sentiment(st.session_state.entry_text)
-        em = EMOJI_MAP[lab]
-        save_entry(entry_date, st.session_state.entry_text, lab, sc, em)
-        st.success(f"{em} บันทึกเรียบร้อย! ({lab.upper()} {sc:.0%})")
-        st.info(f"💡 คำแนะนำวันนี้: {suggest_message(lab, sc)}")
+        result = save_and_score(entry_date, st.session_state.entry_text)
+        if result is None:
+            st.success(f"{PENDING_EMOJI} บันทึกเรียบร้อย! กำลังวิเคราะห์ความรู้สึก…")
+        else:
+            lab, sc = result
+            st.success(f"{EMOJI_MAP[lab]} บันทึกเรียบร้อย! ({lab.upper()} {sc:.0%})")
+            st.info(f"💡 คำแนะนำวันนี้: {suggest_message(lab, sc)}")
         st.session_state.entry_text = ""
         st.session_state.entry_date = datetime.now().date()
     else:
@@ -401,13 +455,43 @@ def on_new_save():
 
 st.button("💾 บันทึกและวิเคราะห์", on_click=on_new_save)
 
+if core.embeddings is not None and st.session_state.get("similar_to"):
+    sim_id, sim_text = st.session_state.similar_to
+    with st.expander("🔁 วันที่คล้ายวันนี้", expanded=True):
+        similar = core.similar_entries(sim_id, sim_text, k=SIMILAR_K)
+        if similar is None:
+            # embedded in the background (model load or indexer); the next rerun shows it
+            st.caption("กำลังวิเคราะห์ความคล้าย… ลองรีเฟรชอีกครั้ง")
+        elif not similar:
+            st.caption("ยังไม่มีบันทึกที่คล้ายกัน")
+        for entry, sim in similar or []:
+            c1, c2, c3, c4 = st.columns([1.3, 5, 0.6, 1])
+            c1.write(str(entry["date"]))
+            c2.write(entry["text"])
+            c3.write(entry["emoji"])
+            c4.caption(f"คล้าย {sim:.0%}")
+
 # ---- Tabs Section (Moved below input) ----
 st.markdown("---")
 
-if df.empty:
+# Calendar and Stats read either the live store or the columnar archive;
+# both answer emoji_by_date() and aggregates() and have their own cache
+history, history_cache = store, data_cache
+if core.archive is not None:
+    with st.sidebar.expander("🗄️ คลังข้อมูล", expanded=True):
+        use_archive = st.radio("ปฏิทินและสถิติอ่านจาก", ["บันทึกปัจจุบัน", "คลังข้อมูล"],
+                               key="history_source") == "คลังข้อมูล"
+        months = core.archive.months()
+        st.caption(f"{len(months)} เดือน · {sum(months.values())} บันทึก ({core.archive.fmt})")
+        if st.button("📦 อัปเดตคลังจากบันทึกปัจจุบัน", key="export_archive"):
+            st.success(f"ส่งออก {core.export_archive()} บันทึกแล้ว")
+    if use_archive:
+        history, history_cache = core.archive, core.archive_cache
+
+if n_entries == 0:
     st.info("ยังไม่มีบันทึกเลย ลองเพิ่มดูสิ")
 else:
-    tab1, tab2, tab3 = st.tabs(["Summary", "Calendar", "Stats"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Summary", "Calendar", "Stats", "Search"])
 
     with tab1:
     
@@ -418,48 +502,92 @@ else:
         </h2>
         """, unsafe_allow_html=True)
 
-        df2 = df.sort_values("date", ascending=False).reset_index(drop=True)
         if "edit_id" not in st.session_state:
             st.session_state.edit_id = None
-
-        for _, row in df2.iterrows():
-            c1, c2, c3, c4, c5, c6 = st.columns([1.3, 4, 1, 1, 1, 0.6])
-            c1.write(str(row["date"]))
-            c2.write(row["text"])
-            c3.write(row["emoji"])
+        if "summary_page" not in st.session_state:
+            st.session_state.summary_page = 1
+
+        n_pending = data_cache.get("count", (None, None, (PENDING,)),
+                                   lambda: store.count_entries(sentiments=[PENDING]))
+        if n_pending:
+            pc1, pc2 = st.columns([4, 1])
+            pc1.info(f"{PENDING_EMOJI} กำลังวิเคราะห์อีก {n_pending} บันทึก")
+            pc2.button("🔄 รีเฟรช", key="refresh_pending")
+
+        # filters and paging run in SQL, so only the visible page is ever loaded
+        fc1, fc2, fc3 = st.columns([2, 2, 1])
+        with fc1:
+            date_range = st.date_input("ช่วงวันที่", value=(), key="summary_range", on_change=reset_summary_page)
+        with fc2:
+            sentiments = st.multiselect("ความรู้สึก", ["pos", "neu", "neg", PENDING],
+                                        key="summary_sentiments", on_change=reset_summary_page)
+        with fc3:
+            page_size = st.selectbox("ต่อหน้า", PAGE_SIZES, index=1, key="summary_page_size",
+                                     on_change=reset_summary_page)
+        start = date_range[0] if len(date_range) > 0 else None
+        end = date_range[1] if len(date_range) > 1 else start
+
+        filters = (start, end, tuple(sentiments))
+        n_rows = data_cache.get("count", filters, lambda: store.count_entries(*filters))
+        n_pages = max(1, -(-n_rows // page_size))
+        st.session_state.summary_page = min(st.session_state.summary_page, n_pages)
+        offset = (st.session_state.summary_page - 1) * page_size
+        df2 = data_cache.get("page", (*filters, page_size, offset),
+                             lambda: store.query_entries(*filters, limit=page_size, offset=offset))
+        if df2.empty:
+            st.info("ไม่พบบันทึกในช่วงที่เลือก")
+
+        # one row of widgets per entry on the page; usually the bulk of a Summary rerun
+        with METRICS.span("summary_rows"):
+            for _, row in df2.iterrows():
+                c1, c2, c3, c4, c5, c6 = st.columns([1.3, 4, 1, 1, 1, 0.6])
+                c1.write(str(row["date"]))
+                c2.write(row["text"])
+                c3.write(row["emoji"])
             
-            if row["sentiment"] == "neg" and row["score"] > 0.7:
-                color_class = "very-neg-score"
-            elif row["score"] > 0.7:
-                color_class = "high-score"
-            elif row["score"] > 0.4:
-                color_class = "medium-score"
-            else:
-                color_class = "low-score"
+                if row["sentiment"] == PENDING:
+                    color_class = "pending-score"
+                elif row["sentiment"] == "neg" and row["score"] > 0.7:
+                    color_class = "very-neg-score"
+                elif row["score"] > 0.7:
+                    color_class = "high-score"
+                elif row["score"] > 0.4:
+                    color_class = "medium-score"
+                else:
+                    color_class = "low-score"
     
-            c4.markdown(f"<div class='{color_class}'>{row['score']:.0%}</div>", unsafe_allow_html=True)
-
-            sentiment = row["sentiment"]
-            sentiment_class = (
-                "sentiment-pos" if sentiment == "pos"
-                else "sentiment-neu" if sentiment == "neu"
-                else "sentiment-neg"
-            )
-            c5.markdown(f"<div class='{sentiment_class}'>{sentiment.upper()}</div>", unsafe_allow_html=True)
-            c6.button("✏️", key=f"edit_{row['id']}", on_click=toggle_edit, args=(row["id"],))
-
-        if st.session_state.edit_id:
+                score_text = "…" if row["sentiment"] == PENDING else f"{row['score']:.0%}"
+                c4.markdown(f"<div class='{color_class}'>{score_text}</div>", unsafe_allow_html=True)
+
+                sentiment = row["sentiment"]
+                sentiment_class = (
+                    "sentiment-pos" if sentiment == "pos"
+                    else "sentiment-neu" if sentiment == "neu"
+                    else "sentiment-pending" if sentiment == PENDING
+                    else "sentiment-neg"
+                )
+                c5.markdown(f"<div class='{sentiment_class}'>{sentiment.upper()}</div>", unsafe_allow_html=True)
+                c6.button("✏️", key=f"edit_{row['id']}", on_click=toggle_edit, args=(row["id"],))
+
+        pg1, pg2 = st.columns([1, 3])
+        with pg1:
+            st.number_input("หน้า", 1, n_pages, key="summary_page")
+        pg2.caption(f"{n_rows} บันทึก · หน้า {st.session_state.summary_page}/{n_pages}")
+
+        old = store.get_entry(st.session_state.edit_id) if st.session_state.edit_id else None
+        if old is not None:
             st.markdown("---")
-            old = df[df["id"] == st.session_state.edit_id].iloc[0]
             st.subheader("🔄 แก้ไขบันทึกย้อนหลัง")
             new_text = st.text_area("ข้อความใหม่", old["text"], height=150)
 
             def on_apply_edit():
-                lab, sc = analyze_sentiment(new_text)
-                em = EMOJI_MAP[lab]
-                save_entry(old["date"], new_text, lab, sc, em)
-                st.success(f"{em} แก้ไขเรียบร้อย! ({lab.upper()} {sc:.0%})")
-                st.info(f"💡 คำแนะนำวันนี้: {suggest_message(lab, sc)}")
+                result = save_and_score(old["date"], new_text)
+                if result is None:
+                    st.success(f"{PENDING_EMOJI} แก้ไขเรียบร้อย! กำลังวิเคราะห์ความรู้สึก…")
+                else:
+                    lab, sc = result
+                    st.success(f"{EMOJI_MAP[lab]} แก้ไขเรียบร้อย! ({lab.upper()} {sc:.0%})")
+                    st.info(f"💡 คำแนะนำวันนี้: {suggest_message(lab, sc)}")
                 st.session_state.edit_id = None
                 st.session_state.should_rerun = True
 
@@ -475,85 +603,172 @@ else:
 
     with tab2:
         st.markdown("<h2 class='summary-title'><span class='emoji'>📅</span> ปฏิทิน Mood</h2>", unsafe_allow_html=True)
+        cal_view = st.radio("มุมมอง", ["รายเดือน", "ทั้งปี"], horizontal=True, key="calendar_view")
         coly, colm = st.columns(2)
         with coly:
             y = st.number_input("ปี", 2000, 2100, datetime.now().year)
-        with colm:
-            m = st.selectbox("เดือน", list(range(1, 13)), index=datetime.now().month - 1)
 
-        cal = calendar.monthcalendar(y, m)
-        last_emo = df.groupby("date")["emoji"].last()
-
-        table = [
-            [
-                f"{d}\n{last_emo.get(datetime(y, m, d).date(), '')}" if d != 0 else ""
-                for d in week
+        if cal_view == "ทั้งปี":
+            with colm:
+                n_years = st.selectbox("จำนวนปี", HEATMAP_YEARS, key="heatmap_years")
+            span = year_span(n_years, y)
+            # one range query on the per-day aggregates, then array lookups per year
+            days = history_cache.get("day_index", span, lambda: day_index(history.aggregates("day", *span)))
+            for year in range(y, y - n_years, -1):
+                fig = history_cache.get("fig", ("heatmap", year, span), METRICS.timed(
+                    "figure_build", lambda: heatmap_figure(days, year, EMOJI_MAP)))
+                with METRICS.span("figure_render"):
+                    st.plotly_chart(fig, width="stretch")
+            st.caption("สีเขียว = บวก, สีแดง = ลบ; สีเข้มขึ้นตามความมั่นใจของโมเดล")
+        else:
+            with colm:
+                m = st.selectbox("เดือน", list(range(1, 13)), index=datetime.now().month - 1)
+
+            cal = calendar.monthcalendar(y, m)
+            month_end = date(y, m, calendar.monthrange(y, m)[1])
+            last_emo = history_cache.get("calendar", (y, m), lambda: history.emoji_by_date(date(y, m, 1), month_end))
+
+            table = [
+                [
+                    f"{d}\n{last_emo.get(datetime(y, m, d).date(), '')}" if d != 0 else ""
+                    for d in week
+                ]
+                for week in cal
             ]
-            for week in cal
-        ]
-        df_calendar = pd.DataFrame(table, columns=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
-        df_calendar.index = [""] * len(df_calendar)
+            df_calendar = pd.DataFrame(table, columns=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+            df_calendar.index = [""] * len(df_calendar)
 
-        st.table(df_calendar)
+            st.table(df_calendar)
 
     with tab3:
-        st.markdown("<h2 class='summary-title'><span class='emoji'>📊</span> สถิติอารมณ์ 7 วันล่าสุด</h2>", unsafe_allow_html=True)
         today = datetime.now().date()
-        start_of_week = today - timedelta(days=today.weekday())
-        recent = df[df["date"] >= start_of_week]
+        choice = st.selectbox("ช่วงเวลา", STATS_RANGES, key="stats_range")
+        if choice == "กำหนดเอง":
+            picked = st.date_input("เลือกช่วงวันที่", value=(today - timedelta(days=89), today), key="stats_custom")
+            start, end, period = stats_range(choice, today, picked)
+        else:
+            start, end, period = stats_range(choice, today)
+        st.markdown(f"<h2 class='summary-title'><span class='emoji'>📊</span> สถิติอารมณ์ ({choice})</h2>", unsafe_allow_html=True)
+
+        # everything below reads the maintained mood_agg table (or only the archive
+        # partitions and columns in range), never raw entries
+        daily = history_cache.get("agg", ("day", start, end), lambda: history.aggregates("day", start, end))
 
-        if recent.empty:
-            st.warning("ยังไม่มีบันทึกในช่วง 7 วัน")
+        if daily.empty:
+            st.warning("ยังไม่มีบันทึกในช่วงเวลานี้")
         else:
-            sentiment_score_map = {"pos": 1.0, "neu": 0.5, "neg": 0.0}
-            recent["scaled_score"] = recent["sentiment"].map(sentiment_score_map)
-            avg = recent["scaled_score"].mean()
+            total = daily["n"].sum()
+            avg = (daily["n"] * daily["sentiment"].map(SENTIMENT_SCORE_MAP)).sum() / total
 
             st.markdown("<h3 class='highlight-yellow'> สรุปค่าเฉลี่ยระดับความรู้สึก</h3>", unsafe_allow_html=True)
-            st.metric("ค่าเฉลี่ยความรู้สึกโดยรวมในช่วง 7 วันล่าสุด", f"{avg * 100:.2f} %")
+            mc1, mc2 = st.columns(2)
+            mc1.metric(f"ค่าเฉลี่ยความรู้สึกโดยรวม ({choice})", f"{avg * 100:.2f} %")
+            mc2.metric("ความมั่นใจเฉลี่ยของโมเดล", f"{daily['score_sum'].sum() / total:.0%}", f"{total} บันทึก", delta_color="off")
 
             emoji, summary = ("😊", "สัปดาห์นี้คุณดูอารมณ์ดีสุด ๆ ไปเลย! เก็บพลังงานดี ๆ ไว้ให้ตัวเองและแบ่งให้คนรอบข้างนะ 💖") if avg >= 0.75 else ("😐", "สัปดาห์นี้อารมณ์ค่อนข้างกลาง ๆ ลองหาเวลาออกไปเที่ยวเผื่อจะเป็นสัปดาห์ที่ดีสุดๆเลยก็ได้ ✨") if avg >= 0.4 else ("😢", "สัปดาห์นี้ดูเหนื่อย ๆ 🫂 อย่าลืมพักผ่อน ทำสิ่งที่ชอบ กินของอร่อยเยอะๆ จะช่วยฮีลใจคุณได้ 💛")
+            if choice != "สัปดาห์นี้":
+                summary = summary.replace("สัปดาห์นี้", "ช่วงนี้")
             col1, col2 = st.columns([1, 3])
             with col1:
-                st.markdown(f"<div style='background:#ffe6f2;border-radius:10px;padding:30px;text-align:center;'><div style='font-size:60px'>{emoji}</div><div style='font-size:18px;'>อารมณ์สัปดาห์นี้</div></div>", unsafe_allow_html=True)
+                st.markdown(f"<div style='background:#ffe6f2;border-radius:10px;padding:30px;text-align:center;'><div style='font-size:60px'>{emoji}</div><div style='font-size:18px;'>อารมณ์{choice}</div></div>", unsafe_allow_html=True)
             with col2:
                 st.markdown(f"<div style='background:#e8f5e9;border-radius:10px;padding:20px;font-size:18px;'>{summary}</div>", unsafe_allow_html=True)
 
-            emoji_sentiment_df = recent.groupby(["emoji", "sentiment"]).size().reset_index(name="count")
-        
-            # กำหนดสีพาสเทลที่ใช้
-            pastel_colors = {
-                "pos": "#A7F3D0",  # สีเขียวพาสเทล
-                "neu": "#FEF9C3",  # สีเหลืองพาสเทล
-                "neg": "#FECACA"  # สีแดงพาสเทล
-            }
-
-            # แสดงกราฟจำนวนอีโมจิ (แยกตามความรู้สึก) ด้วยสีพาสเทล
+            # figures are cached per data version and range as go.Figure objects:
+            # st.plotly_chart still serialises them on every rerun, but skips the
+            # validation pass it runs over plain dicts (figure_build only times misses)
             col1, col2 = st.columns(2)
             with col1:
-                fig_emoji = px.bar(emoji_sentiment_df, x="emoji", y="count", color="sentiment", 
-                               title="จำนวนอีโมจิ (แยกตามความรู้สึก)",
-                               color_discrete_map=pastel_colors)  # ใช้สีพาสเทล
-                st.plotly_chart(fig_emoji, use_container_width=True)
-        
-            # แสดงกราฟสัดส่วนความรู้สึก (Pie chart) ด้วยสีพาสเทล
+                fig = history_cache.get("fig", ("emoji", start, end),
+                                         METRICS.timed("figure_build", lambda: emoji_bar_figure(daily)))
+                with METRICS.span("figure_render"):
+                    st.plotly_chart(fig, width="stretch")
             with col2:
-                sentiment_counts = recent["sentiment"].value_counts().reset_index()
-                sentiment_counts.columns = ["sentiment", "count"]
-                fig_sentiment = px.pie(sentiment_counts, names="sentiment", values="count", 
-                                   title="สัดส่วนความรู้สึก",
-                                   color="sentiment", 
-                                   color_discrete_map=pastel_colors)  # ใช้สีพาสเทล
-                st.plotly_chart(fig_sentiment, use_container_width=True)
+                fig = history_cache.get("fig", ("pie", start, end),
+                                         METRICS.timed("figure_build", lambda: sentiment_pie_figure(daily)))
+                with METRICS.span("figure_render"):
+                    st.plotly_chart(fig, width="stretch")
 
             st.markdown("<h4 class='highlight-yellow'>แนวโน้ม Sentiment</h4>", unsafe_allow_html=True)
-            recent["mood_level"] = recent["sentiment"].map({"neg": 1, "neu": 2, "pos": 3})
-            recent["day_label"] = recent["date"].apply(lambda d: d.strftime("%a %d %b"))
-            mood_trend = recent.groupby("day_label", sort=False)["mood_level"].mean().reset_index()
-            fig = px.line(mood_trend, x="day_label", y="mood_level", markers=True, title="📊 Mood Trend (Past 7 Days)")
-            fig.update_yaxes(tickvals=[1, 2, 3], ticktext=["😢 NEG", "😐 NEU", "😊 POS"], range=[0.8, 3.2])
-            fig.update_traces(line_color="#FF69B4", marker=dict(color="#FFB6C1", size=10))
-            st.plotly_chart(fig, use_container_width=True)
+            daily_detail = st.checkbox(f"รายวัน + ค่าเฉลี่ย {ROLLING_DAYS} วัน", key="stats_daily")
+            title = f"📊 Mood Trend ({choice})"
+            if daily_detail:
+                # long ranges are LTTB-downsampled; the rolling mean is part of the cached frame
+                trend = history_cache.get("daily_mood", (start, end), lambda: daily_mood(daily))
+                fig = history_cache.get("fig", ("daily", start, end, title),
+                                         METRICS.timed("figure_build", lambda: daily_trend_figure(trend, title)))
+            else:
+                fig = history_cache.get("fig", ("trend", period, start, end, title), METRICS.timed(
+                    "figure_build", lambda: bucket_trend_figure(mood_trend(period, start, end), title)))
+            with METRICS.span("figure_render"):
+                st.plotly_chart(fig, width="stretch")
+
+    with tab4:
+        st.markdown("<h2 class='summary-title'><span class='emoji'>🔍</span> ค้นหาบันทึก</h2>", unsafe_allow_html=True)
+        query = st.text_input("คำค้น", key="search_query", placeholder="เช่น ทะเล, สอบ, แมว")
+        sc1, sc2 = st.columns(2)
+        with sc1:
+            search_range = st.date_input("ช่วงวันที่", value=(), key="search_range")
+        with sc2:
+            search_sentiments = st.multiselect("ความรู้สึก", ["pos", "neu", "neg", PENDING], key="search_sentiments")
+
+        if query.strip():
+            s_start = search_range[0] if len(search_range) > 0 else None
+            s_end = search_range[1] if len(search_range) > 1 else s_start
+            key = (query.strip(), s_start, s_end, tuple(search_sentiments))
+            # ranked by the trigram index in SQLite; no scan over every entry's text
+            hits = data_cache.get("search", key, lambda: store.search(*key, limit=SEARCH_LIMIT))
+            st.caption(f"พบ {len(hits)} บันทึก" + (f" (แสดง {SEARCH_LIMIT} อันดับแรก)" if len(hits) == SEARCH_LIMIT else ""))
+            if hits.empty:
+                st.info("ไม่พบบันทึกที่ตรงกับคำค้น")
+            with METRICS.span("search_rows"):
+                for _, row in hits.iterrows():
+                    c1, c2, c3, c4 = st.columns([1.3, 5, 0.6, 1])
+                    c1.write(str(row["date"]))
+                    c2.write(row["text"])
+                    c3.write(row["emoji"])
+                    c4.write(row["sentiment"].upper())
+
+with st.sidebar.expander("⚙️ Inference cache"):
+    st.json(sentiment_cache.stats())
+    st.caption("micro-batcher")
+    st.json(batcher.stats())
+    st.caption("data cache")
+    st.json(data_cache.stats())
+    if MULTI_USER:
+        st.caption("user shards")
+        st.json(get_user_cores().stats())
+    st.caption(
+        f"model: {core.backend}, "
+        + (f"loaded in {sentiment_pipe.load_seconds:.1f}s" if sentiment_pipe.loaded else "not loaded yet")
+    )
+    # a full scan of entries, so only once per store generation
+    n_stale = data_cache.get("count_stale", MODEL_VERSION, lambda: store.count_stale(MODEL_VERSION))
+    st.caption(
+        f"version {MODEL_VERSION}: {n_stale} stale rows, "
+        f"{stale_rescorer.rescored} re-scored"
+    )
+
+if METRICS.enabled:
+    with st.sidebar.expander("📈 Metrics"):
+        # histograms since process start; the same numbers go to the dump file
+        hists = pd.DataFrame([
+            {"metric": h["name"].removeprefix("soundinjai_") + (f"[{h['span']}]" if h["span"] else ""),
+             "n": h["count"],
+             **{q: h[q] * (1000 if h["name"].endswith("_seconds") else 1) if h[q] is not None else None
+                for q in ("p50", "p90", "p99")}}
+            for h in METRICS.snapshot()["histograms"]
+        ])
+        st.caption("p50 / p90 / p99 (ms, or items for batch size and tokens)")
+        st.dataframe(hists, hide_index=True)
+        recent = list(METRICS.reruns)[-10:]
+        if recent:
+            st.caption("last reruns (ms)")
+            st.dataframe(pd.DataFrame([
+                {"total": r["seconds"] * 1000, **{k: v * 1000 for k, v in r["spans"].items()}} for r in recent
+            ]).round(1), hide_index=True)
+        st.download_button("⬇️ Prometheus", METRICS.prometheus_text(), file_name="metrics.prom",
+                           key="metrics_download")
 
 # Optional: Auto-refresh after save/edit/delete
 if st.session_state.get("should_rerun", False):
@@ -565,3 +780,15 @@ if st.session_state.get("should_rerun", False):
         }, 2000);
         </script>
     """, unsafe_allow_html=True)
+
+data_cache.end_rerun()
+METRICS.end_rerun(rows=n_entries)
+
+startup_timing.record_first_paint(
+    script_imports_s=_script_imports_s,
+    paint_s=time.perf_counter() - _script_t0,
+    torch_imported=_torch_at_import,
+    backend=core.backend,
+    warmup=core.warmup,
+    model_loaded=sentiment_pipe.loaded,
+)
@@ -0,0 +1,118 @@
+"""Stats tab figures, built once per data version so they can be cached and shared.
+
+Long daily series are reduced with Largest-Triangle-Three-Buckets before
+they are plotted, so a multi-year trend sends at most ``MAX_POINTS`` points
+to the browser while keeping its peaks and dips.
+"""
+import numpy as np
+import pandas as pd
+
+MAX_POINTS = 500
+ROLLING_DAYS = 7
+MOOD_LEVEL_MAP = {"neg": 1, "neu": 2, "pos": 3}
+PASTEL_COLORS = {
+    "pos": "#A7F3D0",  # สีเขียวพาสเทล
+    "neu": "#FEF9C3",  # สีเหลืองพาสเทล
+    "neg": "#FECACA",  # สีแดงพาสเทล
+}
+
+
+def lttb(x, y, threshold):
+    """Indices of the ``threshold`` points LTTB keeps from ``(x, y)`` (x ascending).
+
+    The first and last points always stay; every bucket in between keeps the
+    point forming the largest triangle with the previous pick and the mean
+    of the next bucket.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        nx, ny = (x[nlo:nhi].mean(), y[nlo:nhi].mean()) if nhi > nlo else (x[-1], y[-1])
+        area = np.abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def daily_mood(daily, window=ROLLING_DAYS):
+    """Per-day mean mood level (1-3) and its trailing ``window``-day mean.
+
+    ``daily`` is ``aggregates("day", ...)`` output. Days without entries are
+    left out of the level but the rolling mean is taken over calendar days.
+    """
+    if daily.empty:
+        return pd.DataFrame(columns=["date", "mood_level", "rolling", "n"])
+    levels = daily.assign(level_sum=daily["n"] * daily["sentiment"].map(MOOD_LEVEL_MAP))
+    per_day = levels.groupby("bucket")[["level_sum", "n"]].sum()
+    per_day.index = pd.to_datetime(per_day.index)
+    per_day = per_day.asfreq("D")
+    sums = per_day.rolling(window, min_periods=1).sum()
+    out = pd.DataFrame({
+        "date": per_day.index,
+        "mood_level": per_day["level_sum"] / per_day["n"],
+        "rolling": sums["level_sum"] / sums["n"],
+        "n": per_day["n"].fillna(0).astype(int),
+    }).reset_index(drop=True)
+    return out[out["n"] > 0].reset_index(drop=True)
+
+
+def _downsampled(x, y, max_points):
+    idx = lttb(np.arange(len(y)), y, max_points)
+    return [x[i] for i in idx], [float(y[i]) for i in idx]
+
+
+def _mood_axes(fig):
+    fig.update_yaxes(tickvals=[1, 2, 3], ticktext=["😢 NEG", "😐 NEU", "😊 POS"], range=[0.8, 3.2])
+
+
+def daily_trend_figure(trend, title, max_points=MAX_POINTS):
+    """Daily mood line plus its rolling mean, each LTTB-reduced to ``max_points``."""
+    import plotly.graph_objects as go
+
+    dates = trend["date"].dt.strftime("%Y-%m-%d").tolist()
+    fig = go.Figure()
+    x, y = _downsampled(dates, trend["mood_level"].to_numpy(), max_points)
+    fig.add_trace(go.Scatter(x=x, y=y, mode="lines+markers" if len(x) <= 60 else "lines", name="รายวัน",
+                             line=dict(color="#FFB6C1", width=1), marker=dict(color="#FFB6C1", size=6)))
+    x, y = _downsampled(dates, trend["rolling"].to_numpy(), max_points)
+    fig.add_trace(go.Scatter(x=x, y=y, mode="lines", name=f"เฉลี่ย {ROLLING_DAYS} วัน",
+                             line=dict(color="#FF69B4", width=3)))
+    fig.update_layout(title=title)
+    _mood_axes(fig)
+    return fig
+
+
+def bucket_trend_figure(trend, title):
+    """Mood line over week / month buckets (``label``, ``mood_level`` columns)."""
+    import plotly.express as px
+
+    fig = px.line(trend, x="label", y="mood_level", markers=True, title=title)
+    _mood_axes(fig)
+    fig.update_traces(line_color="#FF69B4", marker=dict(color="#FFB6C1", size=10))
+    return fig
+
+
+def emoji_bar_figure(daily):
+    import plotly.express as px
+
+    counts = daily.groupby(["emoji", "sentiment"])["n"].sum().reset_index(name="count")
+    return px.bar(counts, x="emoji", y="count", color="sentiment",
+                  title="จำนวนอีโมจิ (แยกตามความรู้สึก)",
+                  color_discrete_map=PASTEL_COLORS)
+
+
+def sentiment_pie_figure(daily):
+    import plotly.express as px
+
+    counts = daily.groupby("sentiment")["n"].sum().reset_index(name="count")
+    return px.pie(counts, names="sentiment", values="count", title="สัดส่วนความรู้สึก",
+                  color="sentiment", color_discrete_map=PASTEL_COLORS)
@@ -0,0 +1,107 @@
+"""Year-at-a-glance mood heatmap (one column per week, one row per weekday).
+
+Fed by the per-day rows of the maintained mood aggregates (``DiaryStore`` or
+``DiaryArchive``), turned into ordinal-day arrays once; placing 365+ days on
+the grid is then array indexing, with no per-day loop over entries.
+"""
+from datetime import date as _date
+
+import numpy as np
+import pandas as pd
+
+# diverging pastel scale over valence -1 (confidently negative) .. +1 (confidently positive)
+COLORSCALE = [[0.0, "#F87171"], [0.35, "#FECACA"], [0.5, "#FEF9C3"], [0.65, "#A7F3D0"], [1.0, "#34D399"]]
+SENTIMENTS = np.array(["neg", "neu", "pos"])
+SIGN = {"neg": -1.0, "neu": 0.0, "pos": 1.0}
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def day_index(daily):
+    """Collapse ``aggregates("day", ...)`` rows into per-day arrays.
+
+    Returns ``(ordinals, valence, sentiment_idx, n)``: the day's ordinal
+    (``date.toordinal()``), the mean of +score / 0 / -score over its entries,
+    the index into ``SENTIMENTS`` of its most frequent sentiment and its
+    entry count; all sorted by ordinal.
+    """
+    if daily.empty:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty.astype(np.int64), empty.astype(np.int64)
+    sign = daily["sentiment"].map(SIGN).fillna(0.0).to_numpy()
+    signed = sign * daily["score_sum"].to_numpy()
+    frame = pd.DataFrame({
+        "bucket": daily["bucket"].to_numpy(),
+        "signed": signed,
+        "n": daily["n"].to_numpy(),
+        "neg": np.where(sign < 0, daily["n"], 0),
+        "neu": np.where(sign == 0, daily["n"], 0),
+        "pos": np.where(sign > 0, daily["n"], 0),
+    }).groupby("bucket", sort=True).sum()
+    days = pd.to_datetime(frame.index).to_numpy().astype("datetime64[D]").astype(np.int64)
+    ordinals = days + _date(1970, 1, 1).toordinal()
+    n = frame["n"].to_numpy()
+    valence = frame["signed"].to_numpy() / np.maximum(n, 1)
+    dominant = frame[list(SENTIMENTS)].to_numpy().argmax(axis=1)
+    return ordinals, valence, dominant, n
+
+
+def year_grid(index, start, end, emoji_map):
+    """7 x weeks arrays (``z``, hover ``text``) and week labels for ``start``..``end``.
+
+    Days without entries are NaN; days outside the range stay blank.
+    """
+    ordinals, valence, dominant, n = index
+    first = start.toordinal() - start.weekday()
+    n_weeks = (end.toordinal() - first) // 7 + 1
+    z = np.full(n_weeks * 7, np.nan)
+    counts = np.zeros(n_weeks * 7, dtype=np.int64)
+    emoji = np.full(n_weeks * 7, "", dtype=object)
+
+    keep = (ordinals >= start.toordinal()) & (ordinals <= end.toordinal())
+    slots = ordinals[keep] - first
+    z[slots] = valence[keep]
+    counts[slots] = n[keep]
+    emoji[slots] = np.array([emoji_map[s] for s in SENTIMENTS], dtype=object)[dominant[keep]]
+
+    cells = np.arange(n_weeks * 7) + first
+    in_range = (cells >= start.toordinal()) & (cells <= end.toordinal())
+    dates = np.datetime_as_string(
+        (cells - _date(1970, 1, 1).toordinal()).astype("datetime64[D]"), unit="D"
+    ).astype(object)
+    text = np.where(
+        counts > 0,
+        dates + " " + emoji + "<br>" + counts.astype(str) + " บันทึก",
+        np.where(in_range, dates, ""),
+    )
+    week_starts = [_date.fromordinal(int(first + 7 * w)) for w in range(n_weeks)]
+    labels = [d.strftime("%b") if d.day <= 7 or w == 0 else "" for w, d in enumerate(week_starts)]
+    return z.reshape(n_weeks, 7).T, text.reshape(n_weeks, 7).T, labels
+
+
+def heatmap_figure(index, year, emoji_map, title=None):
+    import plotly.graph_objects as go
+
+    z, text, labels = year_grid(index, _date(year, 1, 1), _date(year, 12, 31), emoji_map)
+    fig = go.Figure(go.Heatmap(
+        z=z,
+        text=text,
+        x=list(range(z.shape[1])),
+        y=WEEKDAYS,
+        hovertemplate="%{text}<extra></extra>",
+        colorscale=COLORSCALE,
+        zmin=-1,
+        zmax=1,
+        xgap=3,
+        ygap=3,
+        showscale=False,
+    ))
+    fig.update_xaxes(tickvals=list(range(len(labels))), ticktext=labels, showgrid=False, zeroline=False)
+    fig.update_yaxes(autorange="reversed", showgrid=False, zeroline=False)
+    fig.update_layout(title=title or str(year), height=220, margin=dict(l=40, r=10, t=40, b=20),
+                      plot_bgcolor="rgba(0,0,0,0)")
+    return fig
+
+
+def year_span(years, last_year):
+    """``(start, end)`` dates covering ``years`` calendar years ending with ``last_year``."""
+    return _date(last_year - years + 1, 1, 1), _date(last_year, 12, 31)